@@ -0,0 +1,194 @@
+# admission.py
+# Admission control for OpenAI-backed generation:
+#   - TokenBucket / UserRateLimiter: per-user request rates, answered with 429
+#   - AdmissionGate: the instance-wide concurrency cap and OpenAI call rate,
+#     with a bounded wait queue in which interactive requests go ahead of
+#     batch (setlist) work, per-request deadlines, and 503 + Retry-After when
+#     the queue is full or a deadline passes
+# Everything here runs on the event loop only, so there are no locks; every
+# decision is O(1).
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)  # served in this order
+
+class TokenBucket:
+    """Refilled lazily from the time of the last take, so idle buckets cost nothing"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> float:
+        """Take cost tokens and return 0, or return the seconds until they will be there"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+class UserRateLimiter:
+    """One TokenBucket per user, for the max_users most recently seen users"""
+
+    def __init__(self, rate_per_minute: float, burst: float, max_users: int = 100000):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()  # user id -> TokenBucket, least recently used first
+        self.limited = 0  # requests turned away
+
+    def take(self, user_id: str, cost: float = 1.0) -> float:
+        """0 if the user may go ahead, else the seconds to wait: math.inf if cost
+        is more than the burst, which no amount of waiting will pay for. A rate
+        of 0 disables the limit"""
+        if self.rate <= 0:
+            return 0.0
+        if cost > self.burst:
+            self.limited += 1
+            return math.inf
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_users:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(user_id)
+        wait = bucket.take(cost)
+        if wait > 0:
+            self.limited += 1
+        return wait
+
+class Rejected(Exception):
+    """Not admitted; retry_after is a hint in whole seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionGate:
+    """At most max_in_flight holders at once, started at no more than rate per
+    second (0 for no rate limit). Callers that cannot start straight away wait
+    in a queue of at most max_queued, interactive first, each until its own
+    deadline. When the queue is full an interactive caller takes the place of
+    the newest batch waiter; anyone else is turned away."""
+
+    def __init__(self, max_in_flight: int, max_queued: int, rate: float = 0.0, burst: float = 1.0):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.in_flight = 0
+        self.queued = 0
+        self.waiters = {priority: deque() for priority in PRIORITIES}  # futures, oldest first
+        self.timer = None  # pending wake-up for when the bucket refills
+        self.stats = {"admitted": 0, "queued": 0, "shed_full": 0, "shed_deadline": 0, "evicted": 0}
+
+    def rate_wait(self) -> float:
+        return self.bucket.take() if self.bucket is not None else 0.0
+
+    def retry_after(self) -> int:
+        """Rough seconds until a new caller would get in: the queue ahead of it
+        drained at the rate limit, and at least a second"""
+        if self.bucket is None:
+            return 1
+        return max(1, math.ceil((self.queued + 1) / self.bucket.rate))
+
+    def would_reject(self, priority: str) -> bool:
+        """True if acquire(priority) would be turned away right now"""
+        if self.in_flight < self.max_in_flight and not self.queued:
+            return False
+        return self.queued >= self.max_queued and not (priority == INTERACTIVE and self.waiters[BATCH])
+
+    def has_spare_capacity(self) -> bool:
+        """True if a new holder would start at once without taking a place
+        from anyone waiting (the rate limit aside)"""
+        return self.in_flight < self.max_in_flight and not self.queued
+
+    async def acquire(self, priority: str, timeout: float):
+        if self.in_flight < self.max_in_flight and not self.queued and self.rate_wait() == 0:
+            self.in_flight += 1
+            self.stats["admitted"] += 1
+            return
+
+        if self.queued >= self.max_queued and not (priority == INTERACTIVE and self.evict_batch_waiter()):
+            self.stats["shed_full"] += 1
+            raise Rejected("queue_full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[priority].append(waiter)
+        self.queued += 1
+        self.stats["queued"] += 1
+        self.dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self.release()  # admitted just as the deadline passed
+            elif not waiter.done():
+                waiter.cancel()
+                self.queued -= 1
+            self.stats["shed_deadline"] += 1
+            raise Rejected("deadline", self.retry_after())
+        except asyncio.CancelledError:
+            # The caller went away: give back the slot or the place in the queue
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                self.release()
+            elif not waiter.done():
+                waiter.cancel()
+                self.queued -= 1
+            raise
+        self.stats["admitted"] += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.dispatch()
+
+    def evict_batch_waiter(self) -> bool:
+        batch = self.waiters[BATCH]
+        while batch:
+            waiter = batch.pop()  # newest first: it has waited least
+            if not waiter.done():
+                waiter.set_exception(Rejected("evicted", self.retry_after()))
+                self.queued -= 1
+                self.stats["evicted"] += 1
+                return True
+        return False
+
+    def next_waiter(self):
+        """The oldest live waiter of the highest priority, skipping abandoned ones"""
+        for priority in PRIORITIES:
+            queue = self.waiters[priority]
+            while queue and queue[0].done():
+                queue.popleft()
+            if queue:
+                return queue
+        return None
+
+    def dispatch(self):
+        """Hand free slots to waiters, as far as the rate limit allows"""
+        while self.in_flight < self.max_in_flight:
+            queue = self.next_waiter()
+            if queue is None:
+                return
+            wait = self.rate_wait()
+            if wait > 0:
+                if self.timer is None:
+                    self.timer = asyncio.get_running_loop().call_later(wait, self.wake)
+                return
+            self.in_flight += 1
+            self.queued -= 1
+            queue.popleft().set_result(None)
+
+    def wake(self):
+        self.timer = None
+        self.dispatch()
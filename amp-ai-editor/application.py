@@ -1,48 +1,290 @@
-from fastapi import FastAPI, HTTPException, Depends, Cookie
+from fastapi import FastAPI, HTTPException, Depends, Cookie, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, EmailStr
-from openai import OpenAI
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, EmailStr, Field
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 import os
 import json
-import boto3
-from botocore.exceptions import ClientError
+import logging
+import time
+import asyncio
+import math
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
 import jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 import uuid
+import zlib
+import gzip
+import hashlib
 import httpx
-from typing import Optional
+from typing import List, Optional, Tuple
+import passwords
+import metrics
+from admission import AdmissionGate, Rejected, UserRateLimiter, INTERACTIVE, BATCH
+from jobs import create_job_store, FINISHED
+import audio
+from audio import AudioSpool, extract_features, describe_features, feature_words
+from catalog import TrackCatalog, search_words
+from assets import AssetStore, accepted_encodings
+from knobs import KnobStreamParser, clean_knobs
+from memory_table import MemoryTable
+from predictor import AmpPredictor
+from presets import PresetStore, KNOBS, valid_preset_id
+from metrics import log_event, span
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
 
 # Load environment variables
 load_dotenv()
 
-print("=" * 60)
-print("STARTING BACKEND WITH AUTHENTICATION")
-print("=" * 60)
-
 # Configuration
 api_key = os.getenv("OPENAI_API_KEY")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-this-in-production")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Auth caches. Verified JWT claims are kept for up to JWT_CACHE_SIZE tokens
+# (by token hash, each until its exp), so repeat requests skip the signature
+# check; 0 disables it. /api/me profiles are kept for PROFILE_CACHE_TTL_SECONDS,
+# and replaced whenever this process writes them.
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+
+# OpenAI Configuration
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+SETLIST_MAX_SONGS = int(os.getenv("SETLIST_MAX_SONGS", "50"))
+SETLIST_PROMPT_SIZE = int(os.getenv("SETLIST_PROMPT_SIZE", "8"))  # songs packed into one OpenAI call
+
+# Generation latency budget. A request for amp settings gets an answer within
+# GENERATE_DEADLINE_SECONDS (for a job, counted from submission): when the
+# generation cannot finish in time or OpenAI fails in a way worth retrying
+# later, the last settings cached for the song, the local predictor's best
+# guess or the default preset is returned instead. An OpenAI call still running after the OPENAI_HEDGE_PERCENTILE
+# latency of recent calls (OPENAI_HEDGE_DEFAULT_SECONDS until enough have been
+# seen) gets a second, identical call if there is a free slot for it; the
+# first answer wins. A percentile of 0 disables hedging.
+GENERATE_DEADLINE_SECONDS = float(os.getenv("GENERATE_DEADLINE_SECONDS", "12"))
+OPENAI_HEDGE_PERCENTILE = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "0.95"))
+OPENAI_HEDGE_DEFAULT_SECONDS = float(os.getenv("OPENAI_HEDGE_DEFAULT_SECONDS", "4"))
+OPENAI_HEDGE_MIN_SECONDS = float(os.getenv("OPENAI_HEDGE_MIN_SECONDS", "0.5"))
+
+# Admission control (see admission.py). At most OPENAI_MAX_CONCURRENCY OpenAI
+# calls run at once, started at up to OPENAI_RATE_PER_SECOND (0: no limit).
+# The rest wait in a queue of ADMISSION_QUEUE_SIZE, interactive requests for
+# up to ADMISSION_INTERACTIVE_WAIT_SECONDS and setlist work for up to
+# ADMISSION_BATCH_WAIT_SECONDS, before being turned away with a 503.
+OPENAI_RATE_PER_SECOND = float(os.getenv("OPENAI_RATE_PER_SECOND", "20"))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_INTERACTIVE_WAIT_SECONDS = float(os.getenv("ADMISSION_INTERACTIVE_WAIT_SECONDS", "5"))
+ADMISSION_BATCH_WAIT_SECONDS = float(os.getenv("ADMISSION_BATCH_WAIT_SECONDS", "30"))
+
+# Per-user generation limit, in songs per minute with bursts of up to
+# USER_GENERATE_BURST (0 disables it); over it, requests get a 429. A setlist
+# is charged one token per song, so longer setlists than the burst are refused
+USER_GENERATE_RATE_PER_MINUTE = float(os.getenv("USER_GENERATE_RATE_PER_MINUTE", "30"))
+USER_GENERATE_BURST = float(os.getenv("USER_GENERATE_BURST", "10"))
+
+# Recommendation cache Configuration (empty table name disables the DynamoDB tier)
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "2048"))
+RECOMMENDATION_CACHE_TTL_SECONDS = int(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", str(60 * 60)))
+RECOMMENDATION_TABLE_TTL_SECONDS = int(os.getenv("RECOMMENDATION_TABLE_TTL_SECONDS", str(30 * 24 * 60 * 60)))
+RECOMMENDATION_TABLE = os.getenv("RECOMMENDATION_TABLE", "ampai-recommendations")
+
+# Local predictor Configuration. PREDICTOR_MODE is "auto" (predict when confident,
+# else ask OpenAI), "local" (never ask OpenAI) or "llm" (never predict)
+PREDICTOR_MODE = os.getenv("PREDICTOR_MODE", "auto")
+PREDICTOR_SIZE = int(os.getenv("PREDICTOR_SIZE", "20000"))  # past recommendations kept
+PREDICTOR_NEIGHBOURS = int(os.getenv("PREDICTOR_NEIGHBOURS", "5"))
+PREDICTOR_MIN_CONFIDENCE = float(os.getenv("PREDICTOR_MIN_CONFIDENCE", "0.8"))
+
 # Spotify Configuration
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+SPOTIFY_ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com")
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com")
+SPOTIFY_TOKEN_RENEW_SECONDS = int(os.getenv("SPOTIFY_TOKEN_RENEW_SECONDS", "300"))  # renew this long before expiry
+SPOTIFY_MAX_CONNECTIONS = int(os.getenv("SPOTIFY_MAX_CONNECTIONS", "50"))
+SPOTIFY_SEARCH_LIMIT = 10
+SPOTIFY_CATALOG_SIZE = int(os.getenv("SPOTIFY_CATALOG_SIZE", "50000"))  # tracks kept for local autocomplete
+SPOTIFY_SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SPOTIFY_SEARCH_CACHE_TTL_SECONDS", str(6 * 60 * 60)))
+
+# Serving processes. uvicorn starts WEB_CONCURRENCY workers (see Procfile and
+# .ebextensions); each imports this module afresh and keeps its own caches,
+# clients and pools, so nothing is shared between them and nothing that
+# owns a socket, thread or process is created at import time.
+WEB_CONCURRENCY = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+
+# Generation jobs (see jobs.py). JOB_STORE is "memory", "sqlite:<path>" or a
+# redis:// URL; with several web workers the default is a SQLite file they
+# all share, and several instances need Redis. Finished jobs are kept for
+# JOB_TTL_SECONDS, and a poll waits at most JOB_POLL_WAIT_SECONDS.
+JOB_STORE = os.getenv("JOB_STORE", "memory" if WEB_CONCURRENCY == 1 else "sqlite:/tmp/ampai-jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "8"))
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", str(60 * 60)))
+JOB_POLL_WAIT_SECONDS = float(os.getenv("JOB_POLL_WAIT_SECONDS", "25"))
+
+# Password hashing (bcrypt cost is BCRYPT_ROUNDS, see passwords.py). Hashing
+# runs in a pool of worker processes; 0 workers falls back to threads. The
+# default splits the cores between the serving processes.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max((os.cpu_count() or 1) // WEB_CONCURRENCY, 1))))
+
+# Audio snippet analysis (see audio.py). Uploads of up to AUDIO_MAX_BYTES are
+# held in memory up to AUDIO_SPOOL_BYTES and on disk beyond that, and decoded
+# by AUDIO_WORKERS processes (0 falls back to threads), at most
+# AUDIO_MAX_UPLOADS at a time. Features are cached by content hash. Each
+# worker holds librosa (hundreds of MB), so the processes start with the
+# first upload, or at startup with AUDIO_WARMUP=1.
+AUDIO_MAX_BYTES = int(os.getenv("AUDIO_MAX_BYTES", str(20 * 1024 * 1024)))
+AUDIO_SPOOL_BYTES = int(os.getenv("AUDIO_SPOOL_BYTES", str(1024 * 1024)))
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", str(max((os.cpu_count() or 1) // WEB_CONCURRENCY, 1))))
+AUDIO_MAX_UPLOADS = int(os.getenv("AUDIO_MAX_UPLOADS", "8"))
+AUDIO_CACHE_SIZE = int(os.getenv("AUDIO_CACHE_SIZE", "1024"))
+AUDIO_CACHE_TTL_SECONDS = int(os.getenv("AUDIO_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+AUDIO_WARMUP = os.getenv("AUDIO_WARMUP", "0") == "1"
+
+# Saved presets (see presets.py). PRESET_TABLE is the DynamoDB table, or
+# "memory" to keep presets in this process for local runs. A page lists at
+# most PRESET_PAGE_MAX presets, and one write adds or deletes at most
+# PRESET_BATCH_MAX.
+PRESET_TABLE = os.getenv("PRESET_TABLE", "ampai-presets")
+PRESET_PAGE_SIZE = int(os.getenv("PRESET_PAGE_SIZE", "500"))
+PRESET_PAGE_MAX = int(os.getenv("PRESET_PAGE_MAX", "1000"))
+PRESET_BATCH_MAX = int(os.getenv("PRESET_BATCH_MAX", "100"))
+
+# Startup warm-up: /health reports 503 until it finishes or times out
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", "10"))
+
+# DynamoDB setup. The boto3 resource is built on first use (boto3 takes a
+# few hundred ms to import and set up, and its sessions are neither safe to
+# create from several threads at once nor to carry across a fork)
+dynamodb = None
+dynamodb_lock = threading.Lock()
+
+class LazyTable:
+    """A DynamoDB Table that is created on first use"""
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    def __init__(self, name: str):
+        self.name = name
+        self.table = None
 
-# DynamoDB setup
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-users_table = dynamodb.Table('ampai-users')
+    def __getattr__(self, attr):
+        if self.table is None:
+            global dynamodb
+            with dynamodb_lock:
+                if self.table is None:
+                    if dynamodb is None:
+                        import boto3
+                        dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
+                    self.table = dynamodb.Table(self.name)
+        return getattr(self.table, attr)
+
+users_table = LazyTable('ampai-users')
+recommendations_table = LazyTable(RECOMMENDATION_TABLE) if RECOMMENDATION_TABLE else None
+preset_store = PresetStore(
+    MemoryTable('userId', range_key='presetId') if PRESET_TABLE == "memory" else LazyTable(PRESET_TABLE)
+)
+
+# OpenAI client (async, shares one connection pool across requests). Created
+# in lifespan; None if it could not be created.
+client: Optional[AsyncOpenAI] = None
+
+def create_openai_client() -> Optional[AsyncOpenAI]:
+    try:
+        return AsyncOpenAI(
+            api_key=api_key,
+            timeout=OPENAI_TIMEOUT_SECONDS,
+            max_retries=OPENAI_MAX_RETRIES
+        )
+    except Exception as e:
+        log_event("openai_client_failed", level=logging.ERROR, error=str(e))
+        return None
+
+# Spotify HTTP client and password hashing pool, shared for the lifetime of
+# the app (see lifespan), and the audio pool, started on first use (see
+# start_audio_pool)
+spotify_http: Optional[httpx.AsyncClient] = None
+password_pool: Optional[ProcessPoolExecutor] = None
+audio_pool: Optional[ProcessPoolExecutor] = None
+
+# Generation job store and its workers (see lifespan and run_jobs_forever)
+job_store = None
+
+# Static files, read, fingerprinted and compressed once at startup (see assets.py)
+static_assets = AssetStore("static")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global spotify_http, password_pool, client, job_store
+    # Independent blocking setup, run side by side off the event loop
+    _, client = await asyncio.gather(
+        run_in_threadpool(static_assets.load),
+        run_in_threadpool(create_openai_client)
+    )
+    if PASSWORD_HASH_WORKERS > 0:
+        # spawn, not fork: the workers must not inherit the event loop and its threads
+        password_pool = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    spotify_http = httpx.AsyncClient(
+        http2=HTTP2_AVAILABLE,
+        timeout=10.0,
+        limits=httpx.Limits(
+            max_connections=SPOTIFY_MAX_CONNECTIONS,
+            max_keepalive_connections=SPOTIFY_MAX_CONNECTIONS,
+            keepalive_expiry=60.0
+        )
+    )
+    renewal = None
+    if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+        renewal = asyncio.ensure_future(renew_spotify_token_forever())
+    predictor_warmup = asyncio.ensure_future(load_predictor_from_table())
+    job_store = create_job_store(JOB_STORE, JOB_TTL_SECONDS)
+    await job_store.start()
+    job_workers = [asyncio.ensure_future(run_jobs_forever()) for _ in range(JOB_WORKERS)]
+    warmup = asyncio.ensure_future(warm_up())
+    audio_warmup = asyncio.ensure_future(warm_up_audio_pool()) if AUDIO_WARMUP else None
+
+    yield
+
+    warmup.cancel()
+    if audio_warmup is not None:
+        audio_warmup.cancel()
+    for worker in job_workers:
+        worker.cancel()
+    await job_store.close()
+    if renewal is not None:
+        renewal.cancel()
+    predictor_warmup.cancel()
+    await spotify_http.aclose()
+    if password_pool is not None:
+        password_pool.shutdown(wait=False)
+    if audio_pool is not None:
+        audio_pool.shutdown(wait=False, cancel_futures=True)
+    if client is not None:
+        await client.close()
 
 # FastAPI app
-application = FastAPI()
+application = FastAPI(lifespan=lifespan)
+
+# Request timing (outermost, so it sees the final status of every response)
+application.add_middleware(metrics.TimingMiddleware)
 
 # CORS
 application.add_middleware(
@@ -53,16 +295,13 @@ application.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files
-application.mount("/static", StaticFiles(directory="static"), name="static")
-
-# OpenAI client
-try:
-    client = OpenAI(api_key=api_key)
-    print("OpenAI client created")
-except Exception as e:
-    print(f"Failed to create OpenAI client: {e}")
-    client = None
+# Static files
+@application.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+def static_file(path: str, request: Request, v: Optional[str] = None):
+    response = static_assets.response(path, request.headers, v)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
 
 # Security
 security = HTTPBearer()
@@ -70,7 +309,91 @@ security = HTTPBearer()
 # Spotify token cache
 spotify_token_cache = {
     "token": None,
-    "expires_at": None
+    "expires_at": None,
+    "refresh": None  # in-flight refresh task, shared by every caller
+}
+
+# Admission control for OpenAI calls and per-user generation limits. Only
+# touched from the event loop, so neither needs a lock.
+openai_gate = AdmissionGate(
+    OPENAI_MAX_CONCURRENCY,
+    ADMISSION_QUEUE_SIZE,
+    rate=OPENAI_RATE_PER_SECOND,
+    burst=OPENAI_MAX_CONCURRENCY
+)
+user_limiter = UserRateLimiter(USER_GENERATE_RATE_PER_MINUTE, USER_GENERATE_BURST)
+
+class TTLCache:
+    """LRU cache whose entries also expire ttl_seconds after being set"""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+
+    def get(self, key, stale: bool = False):
+        """The value for key, or None if missing or expired. Expired entries
+        stay until evicted, and stale=True returns them too."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if not stale and time.monotonic() >= expires_at:
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl_seconds: Optional[float] = None):
+        """Store value for ttl_seconds, or the cache's TTL if not given"""
+        self._data[key] = (time.monotonic() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+# Verified token claims by SHA-256 of the token, and /api/me profiles by user
+# id. Only touched from the event loop.
+verified_tokens = TTLCache(JWT_CACHE_SIZE, JWT_EXPIRATION_HOURS * 60 * 60)
+profile_cache = TTLCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL_SECONDS)
+auth_stats = {"jwt_verified": 0, "jwt_cache_hits": 0, "profile_hits": 0, "profile_reads": 0}
+
+# Local autocomplete: catalog of every track the search proxy has returned, and
+# the track ids Spotify returned per normalized query. A query whose upstream
+# page was not full has all its results in the catalog, so longer queries that
+# extend it can be filtered locally.
+track_catalog = TrackCatalog(SPOTIFY_CATALOG_SIZE)
+spotify_query_results = TTLCache(SPOTIFY_CATALOG_SIZE, SPOTIFY_SEARCH_CACHE_TTL_SECONDS)
+spotify_search_stats = {
+    "local": 0,
+    "upstream": 0,
+}
+
+amp_predictor = AmpPredictor(PREDICTOR_SIZE, PREDICTOR_NEIGHBOURS)
+
+# Recommendation cache: in-process LRU in front of the DynamoDB table, plus the
+# generations currently running so concurrent requests for a song share one
+recommendation_cache = TTLCache(RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_CACHE_TTL_SECONDS)
+recommendations_in_flight = {}
+recommendation_stats = {
+    "memory_hits": 0,
+    "table_hits": 0,
+    "predicted": 0,
+    "misses": 0,
+    "coalesced": 0,
+}
+# OpenAI call latencies (admission wait excluded), for the hedging delay
+openai_latency = metrics.LatencyWindow()
+generation_stats = {
+    "hedged": 0,
+    "hedge_wins": 0,
+    "fallback_cached": 0,
+    "fallback_predicted": 0,
+    "fallback_default": 0,
 }
 
 # Pydantic models
@@ -83,19 +406,68 @@ class LoginRequest(BaseModel):
     email: EmailStr
     password: str
 
+class AudioFeatures(BaseModel):
+    """Measurements of an audio snippet, as returned by /api/audio/features"""
+    duration_seconds: float
+    tempo_bpm: float
+    spectral_centroid_hz: float
+    rms_db: float
+    crest_factor_db: float
+    spectral_flatness: float
+    zero_crossing_rate: float
+    clipping_ratio: float
+
+    def words(self) -> list:
+        return feature_words(self.model_dump())
+
 class SongRequest(BaseModel):
     song_name: str
     artist: str = ""
     album: str = ""
     spotify_id: str = ""
     desired_tone: str = ""
+    audio_features: Optional[AudioFeatures] = None
+
+class SetlistRequest(BaseModel):
+    songs: List[SongRequest]
+
+class KnobSettings(BaseModel):
+    gain: float = Field(50, ge=0, le=100)
+    volume: float = Field(50, ge=0, le=100)
+    bass: float = Field(50, ge=0, le=100)
+    treble: float = Field(50, ge=0, le=100)
+    presence: float = Field(50, ge=0, le=100)
+    master: float = Field(50, ge=0, le=100)
+
+class PresetRequest(BaseModel):
+    name: str = Field(min_length=1, max_length=100)
+    amp: str = Field("", max_length=100)
+    song_name: str = Field("", max_length=200)
+    artist: str = Field("", max_length=200)
+    settings: KnobSettings
+
+class PresetBatchRequest(BaseModel):
+    presets: List[PresetRequest] = []
+    delete: List[str] = []  # preset ids
 
 # Helper functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def run_password_task(fn, *args):
+    """Run a passwords.py function off the event loop"""
+    with span("bcrypt"):
+        if password_pool is None:
+            return await run_in_threadpool(fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(password_pool, fn, *args)
+
+async def run_dynamodb(fn, *args, **kwargs):
+    """Run a blocking boto3 table call in the thread pool. Pass a function
+    that looks the table method up, as in lambda: users_table.get_item(...):
+    the first lookup on a LazyTable builds the boto3 resource, which must not
+    happen on the event loop"""
+    with span("dynamodb"):
+        return await run_in_threadpool(fn, *args, **kwargs)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def hash_password(password: str) -> str:
+    return await run_password_task(passwords.hash_password, password)
 
 def create_jwt_token(user_id: str, email: str) -> str:
     payload = {
@@ -106,17 +478,41 @@ def create_jwt_token(user_id: str, email: str) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 def verify_jwt_token(token: str) -> dict:
+    """The claims of a valid token. Claims are cached by the token's hash
+    until its exp, after which it is checked (and rejected) in full again;
+    the claims returned are shared, so do not change them."""
+    token_hash = hashlib.sha256(token.encode()).digest()
+    payload = verified_tokens.get(token_hash)
+    if payload is not None:
+        auth_stats["jwt_cache_hits"] += 1
+        return payload
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    auth_stats["jwt_verified"] += 1
+    if isinstance(payload.get("exp"), (int, float)):
+        verified_tokens.set(token_hash, payload, ttl_seconds=payload["exp"] - time.time())
+    return payload
+
+def remember_profile(user: dict) -> dict:
+    """Cache what /api/me returns for a user. Call it wherever a user's email
+    or name is written, so this process never serves the old ones; other
+    processes see the change within PROFILE_CACHE_TTL_SECONDS."""
+    profile = {
+        "userId": user['userId'],
+        "email": user['email'],
+        "name": user.get('name', '')
+    }
+    profile_cache.set(profile["userId"], profile)
+    return profile
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
-    payload = verify_jwt_token(token)
+    with span("jwt_verify"):
+        payload = verify_jwt_token(token)
     return payload
 
 async def get_spotify_token() -> Optional[str]:
@@ -125,64 +521,86 @@ async def get_spotify_token() -> Optional[str]:
     
     # Return cached token if still valid
     if spotify_token_cache["token"] and spotify_token_cache["expires_at"] and now < spotify_token_cache["expires_at"]:
-        print("🎵 Using cached Spotify token")
         return spotify_token_cache["token"]
     
-    # Get new token
-    print("🎵 Requesting new Spotify token...")
+    return await refresh_spotify_token()
+
+async def refresh_spotify_token() -> Optional[str]:
+    """Fetch a new token, joining the refresh already in flight if there is one"""
+    task = spotify_token_cache["refresh"]
+    if task is None:
+        task = asyncio.ensure_future(request_spotify_token())
+        spotify_token_cache["refresh"] = task
+        task.add_done_callback(lambda _: spotify_token_cache.update(refresh=None))
+    return await asyncio.shield(task)
+
+async def request_spotify_token() -> Optional[str]:
+    now = datetime.utcnow()
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://accounts.spotify.com/api/token",
+        with span("spotify_token"):
+            response = await spotify_http.post(
+                f"{SPOTIFY_ACCOUNTS_URL}/api/token",
                 headers={
                     "Content-Type": "application/x-www-form-urlencoded",
                 },
                 auth=(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET),
                 data={"grant_type": "client_credentials"}
             )
+        
+        if response.status_code == 200:
+            data = response.json()
+            token = data["access_token"]
+            expires_in = data["expires_in"]  # seconds
+            
+            # Cache token
+            spotify_token_cache["token"] = token
+            spotify_token_cache["expires_at"] = now + timedelta(seconds=expires_in - 60)  # 60s buffer
+            
+            log_event("spotify_token_refreshed", expires_in=expires_in)
+            return token
+        else:
+            log_event("spotify_token_failed", level=logging.ERROR, status=response.status_code)
+            return None
             
-            if response.status_code == 200:
-                data = response.json()
-                token = data["access_token"]
-                expires_in = data["expires_in"]  # seconds
-                
-                # Cache token
-                spotify_token_cache["token"] = token
-                spotify_token_cache["expires_at"] = now + timedelta(seconds=expires_in - 60)  # 60s buffer
-                
-                print(f"✅ Spotify token obtained (expires in {expires_in}s)")
-                return token
-            else:
-                print(f"❌ Spotify auth failed: {response.status_code}")
-                return None
-                
     except Exception as e:
-        print(f"❌ Spotify auth error: {e}")
+        log_event("spotify_token_failed", level=logging.ERROR, error=repr(e))
         return None
 
+async def renew_spotify_token_forever():
+    """Background task that refreshes the token SPOTIFY_TOKEN_RENEW_SECONDS
+    before it expires, so searches never wait on a refresh"""
+    while True:
+        await refresh_spotify_token()
+        expires_at = spotify_token_cache["expires_at"]
+        if expires_at is not None and expires_at > datetime.utcnow():
+            delay = (expires_at - datetime.utcnow()).total_seconds() - SPOTIFY_TOKEN_RENEW_SECONDS
+            await asyncio.sleep(max(delay, 5))
+        else:
+            await asyncio.sleep(30)  # last refresh failed, retry soon
+
 # Routes - Public pages
 @application.get("/")
-def landing_page():
+def landing_page(request: Request):
     """Landing page - public"""
-    landing_path = os.path.join("static", "landing", "index.html")
-    if os.path.exists(landing_path):
-        return FileResponse(landing_path)
+    response = static_assets.response("landing/index.html", request.headers)
+    if response is not None:
+        return response
     return {"message": "Landing page not found"}
 
 @application.get("/saved")
-def saved_page():
+def saved_page(request: Request):
      """Saved page - public"""
-     saved_path = os.path.join("static", "saved", "index.html")
-     if os.path.exists(saved_path):
-         return FileResponse(saved_path)
+     response = static_assets.response("saved/index.html", request.headers)
+     if response is not None:
+         return response
      return {"message": "saved page not found"}
 
 @application.get("/app")
-def app_page():
+def app_page(request: Request):
     """Amp editor - requires authentication (checked client-side)"""
-    app_path = os.path.join("static", "app", "index.html")
-    if os.path.exists(app_path):
-        return FileResponse(app_path)
+    response = static_assets.response("app/index.html", request.headers)
+    if response is not None:
+        return response
     return {"message": "App not found"}
 
 # Auth endpoints
@@ -191,26 +609,26 @@ async def signup(request: SignupRequest):
     """Create new user account"""
     try:
         # Check if user exists
-        response = users_table.query(
+        response = await run_dynamodb(lambda: users_table.query(
             IndexName='email-index',
             KeyConditionExpression='email = :email',
             ExpressionAttributeValues={':email': request.email}
-        )
+        ))
         
         if response['Items']:
             raise HTTPException(status_code=400, detail="Email already registered")
         
         # Create user
         user_id = str(uuid.uuid4())
-        hashed_pw = hash_password(request.password)
+        hashed_pw = await hash_password(request.password)
         
-        users_table.put_item(Item={
+        await run_dynamodb(lambda: users_table.put_item(Item={
             'userId': user_id,
             'email': request.email,
             'password': hashed_pw,
             'name': request.name,
             'created_at': datetime.utcnow().isoformat()
-        })
+        }))
         
         # Create token
         token = create_jwt_token(user_id, request.email)
@@ -218,15 +636,15 @@ async def signup(request: SignupRequest):
         return {
             "message": "User created successfully",
             "token": token,
-            "user": {
+            "user": remember_profile({
                 "userId": user_id,
                 "email": request.email,
                 "name": request.name
-            }
+            })
         }
         
     except ClientError as e:
-        print(f"DynamoDB error: {e}")
+        log_event("dynamodb_error", level=logging.ERROR, error=repr(e))
         raise HTTPException(status_code=500, detail="Database error")
 
 @application.post("/api/login")
@@ -234,60 +652,194 @@ async def login(request: LoginRequest):
     """Login user"""
     try:
         # Find user by email
-        response = users_table.query(
+        response = await run_dynamodb(lambda: users_table.query(
             IndexName='email-index',
             KeyConditionExpression='email = :email',
             ExpressionAttributeValues={':email': request.email}
-        )
+        ))
         
         if not response['Items']:
             raise HTTPException(status_code=401, detail="Invalid email or password")
         
         user = response['Items'][0]
         
-        # Verify password
-        if not verify_password(request.password, user['password']):
+        # Verify password (re-hashing it if BCRYPT_ROUNDS changed)
+        verified, new_hash = await run_password_task(
+            passwords.verify_and_update, request.password, user['password']
+        )
+        if not verified:
             raise HTTPException(status_code=401, detail="Invalid email or password")
         
+        if new_hash:
+            try:
+                await run_dynamodb(lambda: users_table.update_item(
+                    Key={'userId': user['userId']},
+                    UpdateExpression='SET password = :password',
+                    ExpressionAttributeValues={':password': new_hash}
+                ))
+            except ClientError as e:
+                # Not fatal, the old hash still verifies; retried on next login
+                log_event("dynamodb_error", level=logging.ERROR, error=repr(e))
+        
         # Create token
         token = create_jwt_token(user['userId'], user['email'])
         
         return {
             "message": "Login successful",
             "token": token,
-            "user": {
-                "userId": user['userId'],
-                "email": user['email'],
-                "name": user.get('name', '')
-            }
+            "user": remember_profile(user)
         }
         
     except ClientError as e:
-        print(f"DynamoDB error: {e}")
+        log_event("dynamodb_error", level=logging.ERROR, error=repr(e))
         raise HTTPException(status_code=500, detail="Database error")
 
 @application.get("/api/me")
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
-    """Get current user info"""
+    """Get current user info (from the profile cache when it has them)"""
+    profile = profile_cache.get(current_user['user_id'])
+    if profile is not None:
+        auth_stats["profile_hits"] += 1
+        return profile
     try:
-        response = users_table.get_item(Key={'userId': current_user['user_id']})
+        auth_stats["profile_reads"] += 1
+        response = await run_dynamodb(lambda: users_table.get_item(Key={'userId': current_user['user_id']}))
         if 'Item' not in response:
             raise HTTPException(status_code=404, detail="User not found")
         
-        user = response['Item']
-        return {
-            "userId": user['userId'],
-            "email": user['email'],
-            "name": user.get('name', '')
-        }
+        return remember_profile(response['Item'])
     except ClientError as e:
-        print(f"DynamoDB error: {e}")
+        log_event("dynamodb_error", level=logging.ERROR, error=repr(e))
         raise HTTPException(status_code=500, detail="Database error")
 
+# Startup warm-up
+warmup_status = {"ready": False, "steps": {}}
+
+def ping_dynamodb():
+    """Build the boto3 resource and open its connection pool"""
+    users_table.get_item(Key={'userId': 'warmup'})
+
+async def warm_up_openai():
+    if client is not None:
+        try:
+            await client.models.retrieve(OPENAI_MODEL)
+        except APIStatusError:
+            pass  # an error response still means the connection is open
+
+async def warm_up_spotify():
+    if SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET:
+        await get_spotify_token()
+
+async def warm_up_password_pool():
+    """Start every hashing process now rather than on the first logins"""
+    if password_pool is not None:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(password_pool, passwords.warm_up) for _ in range(PASSWORD_HASH_WORKERS)
+        ))
+
+def start_audio_pool() -> Optional[ProcessPoolExecutor]:
+    """The audio worker pool, created on first use; None when AUDIO_WORKERS
+    is 0. Event loop only. The executor spawns its processes as work arrives."""
+    global audio_pool
+    if audio_pool is None and AUDIO_WORKERS > 0:
+        # spawn, not fork: the workers must not inherit the event loop and its threads
+        audio_pool = ProcessPoolExecutor(
+            max_workers=AUDIO_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return audio_pool
+
+async def warm_up_audio_pool():
+    """With AUDIO_WARMUP, start every audio worker and load librosa in it in
+    the background. Slower than the rest of the warm-up and only needed by
+    uploads, so /health does not wait"""
+    pool = start_audio_pool()
+    if pool is None:
+        return
+    loop = asyncio.get_running_loop()
+    try:
+        with span("warmup_audio_pool"):
+            await asyncio.gather(*(loop.run_in_executor(pool, audio.warm_up) for _ in range(AUDIO_WORKERS)))
+    except Exception as e:
+        log_event("warmup_failed", level=logging.WARNING, step="audio_pool", error=repr(e))
+
+async def warm_up_step(name: str, step):
+    try:
+        with span(f"warmup_{name}"):
+            await step
+        warmup_status["steps"][name] = "ok"
+    except Exception as e:
+        warmup_status["steps"][name] = "failed"
+        log_event("warmup_failed", level=logging.WARNING, step=name, error=repr(e))
+
+async def warm_up():
+    """Open the DynamoDB, OpenAI and Spotify connections and start the hashing
+    processes, then let /health report ready. A step that fails or overruns
+    WARMUP_TIMEOUT_SECONDS is left to the first request that needs it."""
+    start = time.perf_counter()
+    steps = {
+        "dynamodb": run_dynamodb(ping_dynamodb),
+        "openai": warm_up_openai(),
+        "spotify": warm_up_spotify(),
+        "password_pool": warm_up_password_pool(),
+    }
+    tasks = [asyncio.ensure_future(warm_up_step(name, step)) for name, step in steps.items()]
+    _, pending = await asyncio.wait(tasks, timeout=WARMUP_TIMEOUT_SECONDS)
+    for task in pending:
+        task.cancel()
+    for name in steps:
+        warmup_status["steps"].setdefault(name, "timed_out")
+    warmup_status["ready"] = True
+    log_event(
+        "ready",
+        seconds=round(time.perf_counter() - start, 3),
+        steps=warmup_status["steps"],
+        pid=os.getpid(),
+        openai=client is not None,
+        spotify=bool(SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET),
+        password_workers=PASSWORD_HASH_WORKERS
+    )
+
 @application.get("/health")
 def health():
+    if not warmup_status["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming_up", "steps": warmup_status["steps"]})
     return {"status": "healthy"}
 
+def search_local_tracks(q: str) -> Optional[list]:
+    """Answer a search from the local catalog, or None if Spotify must be asked.
+
+    Served locally when the same query was fetched recently, or when a
+    shorter query it extends came back with a partial (therefore complete)
+    page; both only while that upstream answer is within its TTL.
+    """
+    words = search_words(q)
+    if not words:
+        return None
+    key = " ".join(words)
+
+    seen = spotify_query_results.get(key)
+    if seen is not None and all(i in track_catalog.tracks for i in seen[0]):  # unless some were evicted since
+        # In Spotify's own (relevance) order, as the first answer was
+        return [track_catalog.tracks[i] for i in seen[0]]
+
+    for end in range(len(key) - 1, 1, -1):
+        if key[end - 1] == " ":
+            continue
+        seen = spotify_query_results.get(key[:end])
+        if seen is not None and seen[1]:
+            return track_catalog.search(words, SPOTIFY_SEARCH_LIMIT, within=set(seen[0]))
+    return None
+
+def remember_spotify_results(q: str, tracks: list):
+    for track in tracks:
+        track_catalog.add(track)
+    key = " ".join(search_words(q))
+    if key:
+        ids = tuple(track["id"] for track in tracks if track.get("id"))
+        spotify_query_results.set(key, (ids, len(tracks) < SPOTIFY_SEARCH_LIMIT))
+
 # Spotify search endpoint - PUBLIC (no auth required)
 @application.get("/api/spotify/search")
 async def spotify_search(q: str):
@@ -295,6 +847,11 @@ async def spotify_search(q: str):
     if not q or len(q) < 2:
         raise HTTPException(status_code=400, detail="Query too short")
     
+    tracks = search_local_tracks(q)
+    if tracks is not None:
+        spotify_search_stats["local"] += 1
+        return {"tracks": {"items": tracks}}
+    
     if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
         raise HTTPException(status_code=500, detail="Spotify credentials not configured")
     
@@ -303,47 +860,748 @@ async def spotify_search(q: str):
         raise HTTPException(status_code=500, detail="Failed to authenticate with Spotify")
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.spotify.com/v1/search",
+        with span("spotify_search"):
+            response = await spotify_http.get(
+                f"{SPOTIFY_API_URL}/v1/search",
                 headers={
                     "Authorization": f"Bearer {token}"
                 },
                 params={
                     "q": q,
                     "type": "track",
-                    "limit": 10
+                    "limit": SPOTIFY_SEARCH_LIMIT
                 },
                 timeout=10.0
             )
+        
+        if response.status_code == 200:
+            data = response.json()
+            remember_spotify_results(q, data.get("tracks", {}).get("items", []))
+            spotify_search_stats["upstream"] += 1
+            return data
+        else:
+            log_event("spotify_search_failed", level=logging.ERROR, status=response.status_code)
+            raise HTTPException(status_code=response.status_code, detail="Spotify search failed")
             
-            if response.status_code == 200:
-                print(f"✅ Spotify search successful for: '{q}'")
-                return response.json()
-            else:
-                print(f"❌ Spotify search failed: {response.status_code}")
-                raise HTTPException(status_code=response.status_code, detail="Spotify search failed")
-                
+    except HTTPException:
+        raise
     except httpx.TimeoutException:
-        print("❌ Spotify search timeout")
+        log_event("spotify_search_failed", level=logging.ERROR, error="timeout")
         raise HTTPException(status_code=504, detail="Spotify search timeout")
     except Exception as e:
-        print(f"❌ Spotify search error: {e}")
+        log_event("spotify_search_failed", level=logging.ERROR, error=repr(e))
         raise HTTPException(status_code=500, detail=str(e))
 
+@asynccontextmanager
+async def openai_slot(priority: str = INTERACTIVE):
+    """Wait for a turn to call OpenAI; 503 if the queue is full or the wait runs too long"""
+    timeout = ADMISSION_INTERACTIVE_WAIT_SECONDS if priority == INTERACTIVE else ADMISSION_BATCH_WAIT_SECONDS
+    try:
+        with span("admission"):
+            await openai_gate.acquire(priority, timeout)
+    except Rejected as e:
+        log_event("admission_rejected", sampled=True, reason=e.reason, priority=priority)
+        raise HTTPException(
+            status_code=503,
+            detail="Amp generator is busy, please try again shortly",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    try:
+        yield
+    finally:
+        openai_gate.release()
+
+def check_generate_rate(user_id: str, songs: int = 1):
+    """429 if the user has used up their generation allowance"""
+    wait = user_limiter.take(user_id, songs)
+    if wait == math.inf:
+        log_event("rate_limited", sampled=True, user=user_id, songs=songs)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Setlists are limited to {int(USER_GENERATE_BURST)} songs at a time, please split this one up"
+        )
+    if wait > 0:
+        log_event("rate_limited", sampled=True, user=user_id, songs=songs)
+        raise HTTPException(
+            status_code=429,
+            detail="Too many amp setting requests, please slow down",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+def amp_settings_messages(request: SongRequest) -> list:
+    measured = ""
+    if request.audio_features is not None:
+        measured = f"Measured from the player's audio snippet: {describe_features(request.audio_features.model_dump())}.\n"
+    prompt = f"""
+Given the song '{request.song_name}' by {request.artist}, recommend guitar amp tone settings.
+{measured}
+Give each knob a whole number from 0 to 100.
+"""
+    return [
+        {
+            "role": "system", 
+            "content": "You are a guitar amp expert."
+        },
+        {"role": "user", "content": prompt}
+    ]
+
+# Structured output: the model can only produce JSON matching these schemas,
+# so there is nothing to strip or repair, and no prose to pay for
+KNOB_SCHEMA = {
+    "type": "object",
+    "properties": {knob: {"type": "integer", "description": "0 to 100"} for knob in KNOBS},
+    "required": KNOBS,
+    "additionalProperties": False,
+}
+AMP_SETTINGS_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "amp_settings", "strict": True, "schema": KNOB_SCHEMA},
+}
+AMP_SETTINGS_MAX_TOKENS = 60
+
+def setlist_format(songs: int) -> dict:
+    """Schema for a setlist answer: knob settings keyed by song number"""
+    numbers = [str(number) for number in range(1, songs + 1)]
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "setlist_amp_settings",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {number: KNOB_SCHEMA for number in numbers},
+                "required": numbers,
+                "additionalProperties": False,
+            },
+        },
+    }
+
+def parse_settings_json(response) -> dict:
+    """The JSON object in a chat completion"""
+    message = response.choices[0].message
+    if not message.content:
+        raise ValueError(f"OpenAI returned no settings ({getattr(message, 'refusal', None) or 'empty answer'})")
+    with span("json_parse"):
+        return json.loads(message.content)
+
+async def request_amp_settings(request: SongRequest, priority: str) -> dict:
+    """One OpenAI call for a song's settings"""
+    async with openai_slot(priority):
+        with span("openai"):
+            started = time.monotonic()
+            response = await client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=amp_settings_messages(request),
+                response_format=AMP_SETTINGS_FORMAT,
+                temperature=0.7,
+                max_tokens=AMP_SETTINGS_MAX_TOKENS
+            )
+            openai_latency.observe(time.monotonic() - started)
+
+    return clean_knobs(parse_settings_json(response))
+
+def hedge_delay() -> Optional[float]:
+    """Seconds to wait on an OpenAI call before hedging it, or None for never"""
+    if OPENAI_HEDGE_PERCENTILE <= 0:
+        return None
+    if len(openai_latency) < 20:
+        return OPENAI_HEDGE_DEFAULT_SECONDS
+    return max(openai_latency.percentile(OPENAI_HEDGE_PERCENTILE), OPENAI_HEDGE_MIN_SECONDS)
+
+async def generate_amp_settings(request: SongRequest, priority: str = INTERACTIVE) -> dict:
+    """Ask OpenAI for amp settings for a song. A call slower than the hedge
+    delay gets a second one alongside it, only if that can start at once, so
+    hedges never queue ahead of other users; the first success wins and the
+    other call is cancelled."""
+    attempts = [asyncio.ensure_future(request_amp_settings(request, priority))]
+    try:
+        done, _ = await asyncio.wait(attempts, timeout=hedge_delay())
+        if not done and openai_gate.has_spare_capacity():
+            generation_stats["hedged"] += 1
+            log_event("openai_hedged", sampled=True, song=request.song_name)
+            attempts.append(asyncio.ensure_future(request_amp_settings(request, priority)))
+
+        pending = attempts
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            failed = [task for task in done if task.exception() is not None]
+            for task in done:
+                if task.exception() is None:
+                    if task is not attempts[0]:
+                        generation_stats["hedge_wins"] += 1
+                    return task.result()
+            if not pending:
+                raise failed[0].exception()
+    finally:
+        for task in attempts:
+            task.cancel()
+
+def setlist_messages(songs: list) -> list:
+    listing = "\n".join(
+        f"{number}. '{song.song_name}' by {song.artist}"
+        + (f" (measured: {describe_features(song.audio_features.model_dump())})" if song.audio_features else "")
+        for number, song in enumerate(songs, start=1)
+    )
+    prompt = f"""
+Recommend guitar amp tone settings for each of these songs:
+{listing}
+
+Answer with the settings keyed by song number, giving each knob a whole number from 0 to 100.
+"""
+    return [
+        {
+            "role": "system", 
+            "content": "You are a guitar amp expert."
+        },
+        {"role": "user", "content": prompt}
+    ]
+
+async def generate_setlist_settings(songs: list) -> list:
+    """Settings for several songs from one OpenAI call; None for any song the
+    model left out"""
+    async with openai_slot(BATCH):
+        with span("openai"):
+            response = await client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=setlist_messages(songs),
+                response_format=setlist_format(len(songs)),
+                temperature=0.7,
+                max_tokens=(AMP_SETTINGS_MAX_TOKENS + 10) * len(songs)
+            )
+
+    results = parse_settings_json(response)
+    settings = []
+    for number in range(1, len(songs) + 1):
+        song_settings = results.get(str(number))
+        settings.append(clean_knobs(song_settings) if isinstance(song_settings, dict) else None)
+    return settings
+
+class KnobFeed:
+    """The knob values of one streamed generation as they arrive, replayed
+    to every request following it. Event loop only."""
+
+    def __init__(self):
+        self.values = []  # (knob, value) in arrival order
+        self.closed = False
+        self.changed = asyncio.Event()
+
+    def add(self, knob: str, value: int):
+        self.values.append((knob, value))
+        self.notify()
+
+    def close(self):
+        self.closed = True
+        self.notify()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def follow(self):
+        """Every value so far, then each new one until the generation ends"""
+        sent = 0
+        while True:
+            changed = self.changed
+            while sent < len(self.values):
+                yield self.values[sent]
+                sent += 1
+            if self.closed:
+                return
+            await changed.wait()
+
+# Knob feeds of the streamed generations in recommendations_in_flight
+knob_feeds = {}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_recommendation(key: str, request: SongRequest, feed: KnobFeed) -> dict:
+    """fill_recommendation() with a streamed OpenAI call, publishing each knob
+    to feed as soon as OpenAI has produced it"""
+    settings = await find_recommendation(key, request)
+    if settings is not None:
+        return settings
+
+    recommendation_stats["misses"] += 1
+    parser = KnobStreamParser()
+    async with openai_slot():
+        with span("openai_stream"):
+            stream = await client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=amp_settings_messages(request),
+                response_format=AMP_SETTINGS_FORMAT,
+                temperature=0.7,
+                max_tokens=AMP_SETTINGS_MAX_TOKENS,
+                stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                for knob, value in parser.feed(chunk.choices[0].delta.content):
+                    feed.add(knob, value)
+
+    # A stream cut short (length or content filter) is a failure, as a reply
+    # that does not parse is for the non-streamed call; never cache made-up knobs
+    with span("json_parse"):
+        settings = json.loads(parser.text)
+    if not isinstance(settings, dict) or any(knob not in settings for knob in KNOBS):
+        raise ValueError("OpenAI returned incomplete settings")
+    settings = clean_knobs(settings)
+    await remember_recommendation(key, request, settings)
+    return settings
+
+def finish_streamed_recommendation(key: str, task: asyncio.Task):
+    knob_feeds.pop(key).close()
+    finish_recommendation(key, task)
+
+async def stream_amp_settings(request: SongRequest, deadline: float):
+    """Server-sent events for one request: a knob event per value as soon as
+    OpenAI has produced it, then a done event with the full settings. Requests
+    for the same song share one generation, which carries on if they all leave.
+    As in get_recommendation_within(), a generation not done by deadline (a
+    time.monotonic() time) or failing transiently ends with fallback settings:
+    the done event then says so under "fallback", and a generation still
+    running carries on, so its settings are cached for the next request."""
+    key = recommendation_key(request)
+    sent = set()
+    error = None
+    try:
+        settings = recommendation_cache.get(key)
+        if settings is not None:
+            recommendation_stats["memory_hits"] += 1
+        else:
+            task = recommendations_in_flight.get(key)
+            if task is not None:
+                recommendation_stats["coalesced"] += 1
+            else:
+                feed = KnobFeed()
+                task = asyncio.ensure_future(stream_recommendation(key, request, feed))
+                recommendations_in_flight[key] = task
+                knob_feeds[key] = feed
+                task.add_done_callback(lambda t: finish_streamed_recommendation(key, t))
+            try:
+                # Only a streamed generation has a feed; others are just awaited
+                feed = knob_feeds.get(key)
+                if feed is not None:
+                    knobs = feed.follow()
+                    while True:
+                        try:
+                            knob, value = await asyncio.wait_for(knobs.__anext__(), max(deadline - time.monotonic(), 0))
+                        except StopAsyncIteration:
+                            break
+                        sent.add(knob)
+                        yield sse_event("knob", {"knob": knob, "value": value})
+                settings = await asyncio.wait_for(asyncio.shield(task), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                error = HTTPException(status_code=504, detail="Amp settings took too long to generate")
+            except Exception as e:
+                error = generation_error(e)
+                if not transient_generation_error(e):
+                    raise error
+
+        if error is not None:
+            settings, source = fallback_recommendation(request)
+            log_event("generation_fallback", level=logging.WARNING, status=error.status_code, fallback=source, song=request.song_name)
+            yield sse_event("done", {"settings": settings, "fallback": source, "detail": error.detail})
+            return
+        for knob in KNOBS:
+            if knob in settings and knob not in sent:
+                yield sse_event("knob", {"knob": knob, "value": settings[knob]})
+        yield sse_event("done", {"settings": dict(settings)})
+
+    except Exception as e:
+        error = generation_error(e)
+        yield sse_event("error", {"status": error.status_code, "detail": error.detail})
+
+def normalize_text(value: str) -> str:
+    return " ".join(value.lower().split())
+
+def recommendation_key(request: SongRequest) -> str:
+    """Cache key for a request, preferring the Spotify track id when we have one"""
+    tone = normalize_text(request.desired_tone)
+    if request.spotify_id.strip():
+        key = f"spotify:{request.spotify_id.strip()}|{tone}"
+    else:
+        key = f"song:{normalize_text(request.song_name)}|{normalize_text(request.artist)}|{tone}"
+    if request.audio_features is not None:
+        measured = json.dumps(request.audio_features.model_dump(), sort_keys=True)
+        key += f"|audio:{zlib.crc32(measured.encode()):08x}"
+    return key
+
+async def load_saved_recommendation(key: str) -> Optional[dict]:
+    """Read a recommendation from the DynamoDB tier (None on miss or error)"""
+    if recommendations_table is None:
+        return None
+    try:
+        response = await run_dynamodb(lambda: recommendations_table.get_item(Key={'cacheKey': key}))
+    except (BotoCoreError, ClientError) as e:
+        log_event("dynamodb_error", level=logging.ERROR, error=repr(e))
+        return None
+    item = response.get('Item')
+    if not item or int(item.get('expires_at', 0)) <= time.time():
+        return None
+    return json.loads(item['settings'])
+
+async def save_recommendation(key: str, request: SongRequest, settings: dict):
+    """Write a recommendation to the DynamoDB tier; failures only cost a future miss"""
+    if recommendations_table is None:
+        return
+    try:
+        await run_dynamodb(lambda: recommendations_table.put_item(Item={
+            'cacheKey': key,
+            'settings': json.dumps(settings),
+            'song': json.dumps(request.model_dump(include=set(AmpPredictor.FIELD_WEIGHTS))),
+            'created_at': datetime.utcnow().isoformat(),
+            'expires_at': int(time.time()) + RECOMMENDATION_TABLE_TTL_SECONDS
+        }))
+    except (BotoCoreError, ClientError) as e:
+        log_event("dynamodb_error", level=logging.ERROR, error=repr(e))
+
+async def remember_recommendation(key: str, request: SongRequest, settings: dict):
+    """Keep a freshly generated recommendation in every cache tier and the predictor"""
+    recommendation_cache.set(key, settings)
+    amp_predictor.add(key, request, settings)
+    await save_recommendation(key, request, settings)
+
+async def find_recommendation(key: str, request: SongRequest) -> Optional[dict]:
+    """Settings from the DynamoDB tier or the local predictor, or None when
+    only OpenAI can answer (never None when PREDICTOR_MODE is "local")"""
+    settings = await load_saved_recommendation(key)
+    if settings is not None:
+        recommendation_stats["table_hits"] += 1
+        recommendation_cache.set(key, settings)
+        return settings
+
+    if PREDICTOR_MODE == "llm":
+        return None
+    with span("predictor"):
+        prediction = amp_predictor.predict(request)
+    if prediction is not None and (prediction[1] >= PREDICTOR_MIN_CONFIDENCE or PREDICTOR_MODE == "local"):
+        recommendation_stats["predicted"] += 1
+        return prediction[0]
+    if PREDICTOR_MODE == "local":
+        recommendation_stats["predicted"] += 1
+        return clean_knobs({})
+    return None
+
+def scan_saved_recommendations(limit: int) -> list:
+    """Up to limit unexpired (key, song, settings) rows from the DynamoDB tier"""
+    rows = []
+    scan_kwargs = {'ProjectionExpression': 'cacheKey, settings, song, expires_at'}
+    while len(rows) < limit:
+        response = recommendations_table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            if 'song' in item and int(item.get('expires_at', 0)) > time.time():
+                rows.append((item['cacheKey'], json.loads(item['song']), json.loads(item['settings'])))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return rows[:limit]
+
+async def load_predictor_from_table():
+    """Seed the predictor with recommendations saved by earlier runs"""
+    if recommendations_table is None or PREDICTOR_MODE == "llm":
+        return
+    try:
+        rows = await run_dynamodb(scan_saved_recommendations, PREDICTOR_SIZE)
+    except (BotoCoreError, ClientError) as e:
+        log_event("dynamodb_error", level=logging.ERROR, error=repr(e))
+        return
+    for key, song, settings in rows:
+        amp_predictor.add(key, SongRequest(**song), clean_knobs(settings))
+    log_event("predictor_loaded", rows=len(rows))
+
+async def fill_recommendation(key: str, request: SongRequest) -> dict:
+    settings = await find_recommendation(key, request)
+    if settings is None:
+        recommendation_stats["misses"] += 1
+        settings = await generate_amp_settings(request)
+        await remember_recommendation(key, request, settings)
+    return settings
+
+def finish_recommendation(key: str, task: asyncio.Task):
+    recommendations_in_flight.pop(key, None)
+    if not task.cancelled():
+        # Mark the exception as retrieved even if every waiter went away
+        task.exception()
+
+async def get_recommendation(request: SongRequest) -> dict:
+    """Amp settings for a song from the memory cache, the DynamoDB cache, an
+    in-flight generation for the same song, or a fresh OpenAI call, in that order"""
+    key = recommendation_key(request)
+
+    settings = recommendation_cache.get(key)
+    if settings is not None:
+        recommendation_stats["memory_hits"] += 1
+        return dict(settings)
+
+    task = recommendations_in_flight.get(key)
+    if task is not None:
+        recommendation_stats["coalesced"] += 1
+    else:
+        # Run the fill as its own task so a disconnecting client does not
+        # cancel the generation other requests are waiting on
+        task = asyncio.ensure_future(fill_recommendation(key, request))
+        recommendations_in_flight[key] = task
+        task.add_done_callback(lambda t: finish_recommendation(key, t))
+
+    return dict(await asyncio.shield(task))
+
+def fallback_recommendation(request: SongRequest) -> Tuple[dict, str]:
+    """Settings when generation ran out of time or failed, and where they came
+    from: the last settings cached for the song even if expired, the
+    predictor's nearest neighbours however unsure it is, or the default preset"""
+    settings = recommendation_cache.get(recommendation_key(request), stale=True)
+    if settings is not None:
+        source = "cached"
+    else:
+        prediction = amp_predictor.predict(request)
+        if prediction is not None:
+            settings, source = prediction[0], "predicted"
+        else:
+            settings, source = clean_knobs({}), "default"
+    generation_stats[f"fallback_{source}"] += 1
+    return dict(settings), source
+
+def transient_generation_error(e: Exception) -> bool:
+    """Whether a failed generation is answered with fallback settings: OpenAI
+    timing out, out of reach, rate limiting us or failing on its side, or its
+    answer not parsing. Admission rejections (503 + Retry-After) and
+    permanent failures such as a bad API key are not."""
+    if isinstance(e, (APIConnectionError, RateLimitError)):
+        return True
+    if isinstance(e, APIStatusError):
+        return e.status_code >= 500
+    return isinstance(e, ValueError)
+
+async def get_recommendation_within(request: SongRequest, deadline: float) -> Tuple[dict, Optional[dict]]:
+    """get_recommendation() by deadline (a time.monotonic() time), else a
+    fallback. Returns the settings and, for a fallback, what went wrong as
+    {"status", "detail", "fallback"}. A generation still running at the
+    deadline carries on, so its settings are cached for the next request.
+    Failures that are not transient raise an HTTPException."""
+    try:
+        settings = await asyncio.wait_for(get_recommendation(request), max(deadline - time.monotonic(), 0))
+        return settings, None
+    except asyncio.TimeoutError:
+        error = HTTPException(status_code=504, detail="Amp settings took too long to generate")
+    except Exception as e:
+        error = generation_error(e)
+        if not transient_generation_error(e):
+            raise error
+    settings, source = fallback_recommendation(request)
+    log_event("generation_fallback", level=logging.WARNING, status=error.status_code, fallback=source, song=request.song_name)
+    return settings, {"status": error.status_code, "detail": error.detail, "fallback": source}
+
+async def fill_setlist_chunk(chunk: list):
+    """Resolve the futures of one chunk of uncached setlist songs, given as
+    (key, request, future) tuples, with a single combined OpenAI call. Songs
+    the model left out, or all of them if the call failed transiently, get a
+    call of their own. Every future is resolved, with an exception if the
+    chunk stops early, so nothing waiting on them hangs."""
+    try:
+        found = await asyncio.gather(*[find_recommendation(key, song) for key, song, _ in chunk])
+        missing = []
+        for (key, song, future), settings in zip(chunk, found):
+            if settings is not None:
+                future.set_result(settings)
+            else:
+                missing.append((key, song, future))
+        if not missing:
+            return
+
+        recommendation_stats["misses"] += len(missing)
+        try:
+            results = await generate_setlist_settings([song for _, song, _ in missing])
+        except Exception as e:
+            # Only a transient OpenAI failure is worth a call per song; an
+            # admission 503 would only shed more load the same way
+            log_event("setlist_chunk_failed", level=logging.WARNING, songs=len(missing), error=repr(e))
+            if not transient_generation_error(e):
+                for _, _, future in missing:
+                    future.set_exception(e)
+                return
+            results = [None] * len(missing)
+
+        async def finish(key, song, future, settings):
+            try:
+                if settings is None:
+                    settings = await generate_amp_settings(song, BATCH)
+            except Exception as e:
+                future.set_exception(e)
+                return
+            future.set_result(settings)
+            await remember_recommendation(key, song, settings)
+
+        await asyncio.gather(*[
+            finish(key, song, future, settings)
+            for (key, song, future), settings in zip(missing, results)
+        ])
+    except Exception as e:
+        log_event("setlist_chunk_failed", level=logging.ERROR, songs=len(chunk), error=repr(e))
+        for _, _, future in chunk:
+            if not future.done():
+                future.set_exception(e)
+    finally:
+        for _, _, future in chunk:
+            if not future.done():
+                future.set_exception(RuntimeError("Setlist generation stopped before this song was done"))
+
+# Setlist chunks running, so they are not garbage collected while no request
+# holds them (the setlist stream may be gone)
+setlist_chunks = set()
+
+async def stream_setlist(songs: List[SongRequest]):
+    """Server-sent events for a setlist: a result or error event per song in
+    the order they finish (cached songs first), then a done event"""
+    indexes = OrderedDict()  # recommendation key -> positions in the setlist
+    for index, song in enumerate(songs):
+        indexes.setdefault(recommendation_key(song), []).append(index)
+
+    cached = []
+    pending = {}
+    uncached = []
+    for key, positions in indexes.items():
+        settings = recommendation_cache.get(key)
+        if settings is not None:
+            recommendation_stats["memory_hits"] += 1
+            cached.append((key, settings))
+        elif key in recommendations_in_flight:
+            recommendation_stats["coalesced"] += 1
+            pending[key] = recommendations_in_flight[key]
+        else:
+            # Registered as in flight so single requests for these songs wait
+            # on the setlist instead of generating them again
+            future = asyncio.get_running_loop().create_future()
+            future.add_done_callback(lambda f, key=key: finish_recommendation(key, f))
+            recommendations_in_flight[key] = future
+            pending[key] = future
+            uncached.append((key, songs[positions[0]], future))
+
+    # Every chunk is started before the first yield: a client that leaves
+    # after that must not strand the futures registered above
+    for start in range(0, len(uncached), SETLIST_PROMPT_SIZE):
+        task = asyncio.ensure_future(fill_setlist_chunk(uncached[start:start + SETLIST_PROMPT_SIZE]))
+        setlist_chunks.add(task)
+        task.add_done_callback(setlist_chunks.discard)
+
+    for key, settings in cached:
+        for index in indexes[key]:
+            yield sse_event("result", {"index": index, "settings": dict(settings)})
+
+    async def wait_for(key, future):
+        try:
+            return key, await asyncio.shield(future), None
+        except Exception as e:
+            return key, None, e
+
+    failed = 0
+    for finished in asyncio.as_completed([wait_for(key, future) for key, future in pending.items()]):
+        key, settings, error = await finished
+        for index in indexes[key]:
+            if error is None:
+                yield sse_event("result", {"index": index, "settings": dict(settings)})
+            else:
+                failed += 1
+                status = error.status_code if isinstance(error, HTTPException) else 500
+                detail = error.detail if isinstance(error, HTTPException) else str(error)
+                yield sse_event("error", {"index": index, "status": status, "detail": detail})
+
+    yield sse_event("done", {"succeeded": len(songs) - failed, "failed": failed})
+
+@application.get("/metrics")
+async def prometheus_metrics():
+    """Latency histograms and cache counters in the Prometheus text format.
+    Async so it runs on the event loop, which is what updates them"""
+    lines = metrics.request_seconds.render() + metrics.stage_seconds.render()
+    lines += metrics.render_counter(
+        "ampai_recommendations_total", "Amp setting lookups by where they were answered",
+        "outcome", recommendation_stats
+    )
+    lines += metrics.render_counter(
+        "ampai_spotify_searches_total", "Spotify searches by where they were answered",
+        "source", spotify_search_stats
+    )
+    lines += metrics.render_counter(
+        "ampai_auth_total", "Token checks and /api/me lookups by how they were answered",
+        "outcome", auth_stats
+    )
+    lines += metrics.render_counter(
+        "ampai_generation_total", "Hedged OpenAI calls and fallback answers by kind",
+        "outcome", generation_stats
+    )
+    lines += metrics.render_counter(
+        "ampai_jobs_total", "Generation job submissions and outcomes",
+        "outcome", job_stats
+    )
+    lines += metrics.render_counter(
+        "ampai_audio_total", "Audio snippet feature lookups by outcome",
+        "outcome", audio_stats
+    )
+    lines += metrics.render_counter(
+        "ampai_presets_total", "Preset listings, 304 revalidations and presets written",
+        "outcome", preset_stats
+    )
+    lines += metrics.render_counter(
+        "ampai_admission_total", "OpenAI admission and per-user rate limit decisions",
+        "outcome", {**openai_gate.stats, "rate_limited": user_limiter.limited}
+    )
+    lines += metrics.render_counter(
+        "ampai_in_use", "Current size of in-process pools and caches", "resource",
+        {
+            "openai_in_flight": openai_gate.in_flight,
+            "openai_queued": openai_gate.queued,
+            "audio_uploads": audio_uploads,
+            "verified_tokens": len(verified_tokens),
+            "profile_cache_entries": len(profile_cache),
+            "recommendation_cache_entries": len(recommendation_cache),
+            "recommendations_in_flight": len(recommendations_in_flight),
+            "spotify_catalog_tracks": len(track_catalog.tracks),
+            "predictor_rows": amp_predictor.size,
+        },
+        kind="gauge"
+    )
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@application.get("/api/cache/stats")
+async def cache_stats():
+    return {
+        "recommendations": {
+            **recommendation_stats,
+            "memory_entries": len(recommendation_cache),
+            "in_flight": len(recommendations_in_flight),
+        },
+        "spotify_search": {
+            **spotify_search_stats,
+            "catalog_tracks": len(track_catalog.tracks),
+        },
+    }
+
+def generation_error(e: Exception) -> HTTPException:
+    """The HTTP error to report for a failed generation"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, APITimeoutError):
+        log_event("openai_timeout", level=logging.ERROR)
+        return HTTPException(status_code=504, detail="OpenAI request timed out")
+    if isinstance(e, json.JSONDecodeError):
+        log_event("openai_bad_json", level=logging.ERROR, error=repr(e))
+        return HTTPException(status_code=500, detail="Failed to parse OpenAI response")
+    log_event("generation_failed", level=logging.ERROR, error=repr(e))
+    return HTTPException(status_code=500, detail=str(e))
+
 # Protected endpoint - Generate amp settings
 @application.post("/api/get_amp_settings")
 async def get_amp_settings(
     request: SongRequest,
     current_user: dict = Depends(get_current_user)
 ):
-    """Generate amp settings - PROTECTED"""
-    print("\n" + "=" * 60)
-    print("🎵 NEW REQUEST (Authenticated)")
-    print("=" * 60)
-    print(f"User: {current_user['email']}")
-    print(f"Song: '{request.song_name}'")
-    print(f"Artist: '{request.artist}'")
+    """Generate amp settings - PROTECTED. Answers within the generation
+    deadline; when that was only possible with fallback settings, the
+    response says so under "fallback" ("cached", "predicted" or "default")."""
+    deadline = time.monotonic() + GENERATE_DEADLINE_SECONDS
+    log_event("generate", sampled=True, user=current_user['user_id'], song=request.song_name, artist=request.artist)
+    check_generate_rate(current_user['user_id'])
     
     if client is None:
         raise HTTPException(
@@ -351,68 +1609,359 @@ async def get_amp_settings(
             detail="OpenAI API key not configured"
         )
     
-    try:
-        prompt = f"""
-Given the song '{request.song_name}' by {request.artist}, recommend guitar amp tone settings.
+    settings, error = await get_recommendation_within(request, deadline)
+    if error is not None:
+        return {"settings": settings, "fallback": error["fallback"]}
+    return {"settings": settings}
 
-Return ONLY a JSON object with these exact keys (values 0-100):
-{{
-    "gain": <number>,
-    "volume": <number>,
-    "bass": <number>,
-    "treble": <number>,
-    "presence": <number>,
-    "master": <number>
-}}
-
-Do not include any other text, explanations, or markdown formatting.
-"""
+@application.post("/api/get_amp_settings/stream")
+async def get_amp_settings_stream(
+    request: SongRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Generate amp settings as server-sent events - PROTECTED. Finishes within
+    the generation deadline, with fallback settings if need be."""
+    deadline = time.monotonic() + GENERATE_DEADLINE_SECONDS
+    log_event("generate_stream", sampled=True, user=current_user['user_id'], song=request.song_name, artist=request.artist)
+    check_generate_rate(current_user['user_id'])
+    
+    if client is None:
+        raise HTTPException(
+            status_code=500, 
+            detail="OpenAI API key not configured"
+        )
+    
+    # Reject up front while we can still send a status code; once the stream
+    # has started, errors arrive as an error event instead
+    if openai_gate.would_reject(INTERACTIVE) and recommendation_cache.get(recommendation_key(request)) is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Amp generator is busy, please try again shortly",
+            headers={"Retry-After": str(openai_gate.retry_after())}
+        )
+    
+    return StreamingResponse(
+        stream_amp_settings(request, deadline),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a guitar amp expert. Return ONLY valid JSON with no markdown formatting."
-                },
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=200
+@application.post("/api/get_amp_settings/batch")
+async def get_amp_settings_batch(
+    request: SetlistRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Generate amp settings for a whole setlist as server-sent events - PROTECTED"""
+    log_event("generate_setlist", sampled=True, user=current_user['user_id'], songs=len(request.songs))
+    
+    if not request.songs:
+        raise HTTPException(status_code=400, detail="Setlist is empty")
+    if len(request.songs) > SETLIST_MAX_SONGS:
+        raise HTTPException(status_code=400, detail=f"Setlists are limited to {SETLIST_MAX_SONGS} songs")
+    check_generate_rate(current_user['user_id'], len(request.songs))
+    
+    if client is None:
+        raise HTTPException(
+            status_code=500, 
+            detail="OpenAI API key not configured"
         )
+    
+    return StreamingResponse(
+        stream_setlist(request.songs),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-        settings_text = response.choices[0].message.content.strip()
-        
-        # Clean up markdown
-        if "```json" in settings_text:
-            settings_text = settings_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in settings_text:
-            settings_text = settings_text.split("```")[1].split("```")[0].strip()
-        
-        settings = json.loads(settings_text)
-        
-        # Validate keys
-        required_keys = ["gain", "volume", "bass", "treble", "presence", "master"]
-        for key in required_keys:
-            if key not in settings:
-                settings[key] = 50
-        
-        print("SUCCESS - Returning settings")
-        print("=" * 60 + "\n")
-        
-        return {"settings": settings}
+# Generation jobs
+job_stats = {"submitted": 0, "reattached": 0, "done": 0, "failed": 0}
+
+def job_view(job: dict) -> dict:
+    view = {"job_id": job["id"], "status": job["status"]}
+    if job["settings"] is not None:
+        view["settings"] = job["settings"]
+    if job["error"] is not None:
+        view["error"] = job["error"]
+    return view
+
+async def run_jobs_forever():
+    """One job worker: takes the next job and records its settings or error"""
+    while True:
+        try:
+            job = await job_store.next()
+        except Exception as e:
+            log_event("job_store_error", level=logging.ERROR, error=repr(e))
+            await asyncio.sleep(1)
+            continue
+        # The deadline counts from submission. A fallback finishes the job as
+        # failed but with settings, so the next submission tries again
+        deadline = time.monotonic() + job["created_at"] + GENERATE_DEADLINE_SECONDS - time.time()
+        try:
+            with span("job"):
+                settings, error = await get_recommendation_within(SongRequest(**job["song"]), deadline)
+            outcome = {"settings": settings, "error": error}
+            job_stats["done" if error is None else "failed"] += 1
+        except Exception as e:
+            error = generation_error(e)
+            outcome = {"error": {"status": error.status_code, "detail": error.detail}}
+            job_stats["failed"] += 1
+        try:
+            await job_store.finish(job["id"], **outcome)
+        except Exception as e:
+            log_event("job_store_error", level=logging.ERROR, error=repr(e))
+
+@application.post("/api/jobs", status_code=202)
+async def submit_job(
+    request: SongRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Queue amp settings generation and return the job at once - PROTECTED.
+    Submitting a song again (a retry, a reconnect) returns the job already
+    queued, running or recently done for it instead of starting another."""
+    log_event("submit_job", sampled=True, user=current_user['user_id'], song=request.song_name, artist=request.artist)
+    
+    if client is None:
+        raise HTTPException(
+            status_code=500, 
+            detail="OpenAI API key not configured"
+        )
+    
+    key = recommendation_key(request)
+    job = await job_store.find(key)
+    if job is None:
+        check_generate_rate(current_user['user_id'])
+        job, created = await job_store.submit(key, request.model_dump())
+    else:
+        created = False
+    job_stats["submitted" if created else "reattached"] += 1
+    return job_view(job)
+
+@application.get("/api/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    wait: float = 0,
+    current_user: dict = Depends(get_current_user)
+):
+    """A job's status, and its settings once done - PROTECTED. With wait, the
+    response is held up to that many seconds for the job to finish."""
+    if wait > 0:
+        job = await job_store.wait(job_id, min(wait, JOB_POLL_WAIT_SECONDS))
+    else:
+        job = await job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_view(job)
+
+@application.websocket("/api/jobs/{job_id}/ws")
+async def job_updates(websocket: WebSocket, job_id: str):
+    """Sends a job's status on connect and again when it finishes, then
+    closes - PROTECTED. Browsers cannot set headers on a WebSocket, and a
+    token in the URL would be written to the access log, so the client sends
+    {"token": ...} as its first message."""
+    await websocket.accept()
+    try:
+        try:
+            message = await asyncio.wait_for(websocket.receive_json(), timeout=10.0)
+            token = message.get("token") if isinstance(message, dict) else None
+            if not isinstance(token, str):
+                raise ValueError("no token")
+            verify_jwt_token(token)
+        except (HTTPException, asyncio.TimeoutError, ValueError, KeyError):
+            await websocket.close(code=1008)
+            return
         
-    except json.JSONDecodeError as e:
-        print(f"JSON Parse Error: {e}")
+        job = await job_store.get(job_id)
+        if job is None:
+            await websocket.send_json({"job_id": job_id, "status": "not_found"})
+        else:
+            await websocket.send_json(job_view(job))
+            while job is not None and job["status"] not in FINISHED:
+                job = await job_store.wait(job_id, JOB_POLL_WAIT_SECONDS)
+                if job is not None:
+                    await websocket.send_json(job_view(job))
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+# Audio snippets
+audio_feature_cache = TTLCache(AUDIO_CACHE_SIZE, AUDIO_CACHE_TTL_SECONDS)  # content hash -> features
+audio_in_flight = {}  # content hash -> extraction task
+audio_uploads = 0  # uploads being received or measured, only touched from the event loop
+audio_stats = {"extracted": 0, "cache_hits": 0, "coalesced": 0, "failed": 0}
+
+async def measure_audio(audio_id: str, spool: AudioSpool) -> dict:
+    """Features of a spooled upload, from a worker process; closes the spool"""
+    try:
+        with span("audio_features"):
+            pool = start_audio_pool()
+            if pool is None:
+                features = await run_in_threadpool(extract_features, spool.source())
+            else:
+                features = await asyncio.get_running_loop().run_in_executor(pool, extract_features, spool.source())
+    finally:
+        spool.close()
+    audio_feature_cache.set(audio_id, features)
+    audio_stats["extracted"] += 1
+    return features
+
+def finish_audio(audio_id: str, task: asyncio.Task):
+    audio_in_flight.pop(audio_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        audio_stats["failed"] += 1
+
+async def get_audio_features(audio_id: str, spool: AudioSpool) -> Tuple[dict, bool]:
+    """Features for an upload and whether they were cached. Takes ownership
+    of the spool; identical uploads in flight share one extraction."""
+    features = audio_feature_cache.get(audio_id)
+    if features is not None:
+        spool.close()
+        audio_stats["cache_hits"] += 1
+        return features, True
+
+    task = audio_in_flight.get(audio_id)
+    if task is not None:
+        spool.close()
+        audio_stats["coalesced"] += 1
+    else:
+        # Its own task, so a client that disconnects does not cancel the
+        # extraction, nor delete the file under the worker
+        task = asyncio.ensure_future(measure_audio(audio_id, spool))
+        audio_in_flight[audio_id] = task
+        task.add_done_callback(lambda t: finish_audio(audio_id, t))
+    return await asyncio.shield(task), False
+
+@application.post("/api/audio/features")
+async def upload_audio(request: Request, current_user: dict = Depends(get_current_user)):
+    """Measure an audio snippet sent as the raw request body - PROTECTED.
+    Pass the returned features as audio_features when asking for amp settings."""
+    global audio_uploads
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > AUDIO_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Audio snippets are limited to {AUDIO_MAX_BYTES // (1024 * 1024)} MB")
+    if audio_uploads >= AUDIO_MAX_UPLOADS:
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to parse OpenAI response"
+            status_code=503,
+            detail="Audio analysis is busy, please try again shortly",
+            headers={"Retry-After": "1"}
         )
     
-    except Exception as e:
-        print(f"ERROR: {type(e).__name__}: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    audio_uploads += 1
+    spool = AudioSpool(AUDIO_SPOOL_BYTES)
+    try:
+        # Streamed chunk by chunk, hashing on the way, so a multi-MB upload is
+        # never held in memory whole
+        digest = hashlib.sha256()
+        try:
+            with span("audio_upload"):
+                async for chunk in request.stream():
+                    if spool.size + len(chunk) > AUDIO_MAX_BYTES:
+                        raise HTTPException(status_code=413, detail=f"Audio snippets are limited to {AUDIO_MAX_BYTES // (1024 * 1024)} MB")
+                    digest.update(chunk)
+                    spool.write(chunk)
+            if spool.size == 0:
+                raise HTTPException(status_code=400, detail="No audio received")
+        except BaseException:
+            spool.close()
+            raise
+        
+        audio_id = digest.hexdigest()
+        log_event("audio_upload", sampled=True, user=current_user['user_id'], bytes=spool.size, audio_id=audio_id)
+        features, cached = await get_audio_features(audio_id, spool)
+        return {"audio_id": audio_id, "features": features, "cached": cached}
+    
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ImportError:
+        log_event("audio_unavailable", level=logging.ERROR)
+        raise HTTPException(status_code=503, detail="Audio analysis is not available on this server")
+    finally:
+        audio_uploads -= 1
+
+# Saved presets. Every write to a user's presets stores a new random
+# presetsRevision on their users_table item, and listings are tagged with it,
+# so a revisit costs one small read and a 304 until the presets change.
+preset_stats = {"listed": 0, "not_modified": 0, "written": 0}
+
+async def load_presets_revision(user_id: str) -> str:
+    response = await run_dynamodb(lambda: users_table.get_item(
+        Key={'userId': user_id},
+        ProjectionExpression='presetsRevision',
+        ConsistentRead=True
+    ))
+    return response.get('Item', {}).get('presetsRevision', '0')
+
+async def bump_presets_revision(user_id: str):
+    """Called after the write, so a listing read before it keeps the old revision"""
+    await run_dynamodb(lambda: users_table.update_item(
+        Key={'userId': user_id},
+        UpdateExpression='SET presetsRevision = :r',
+        ExpressionAttributeValues={':r': uuid.uuid4().hex[:16]}
+    ))
+
+async def write_presets(user_id: str, presets: List[dict], delete_ids: List[str]) -> List[str]:
+    if len(presets) + len(delete_ids) > PRESET_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {PRESET_BATCH_MAX} presets can be written at once")
+    if not all(valid_preset_id(preset_id) for preset_id in delete_ids):
+        raise HTTPException(status_code=400, detail="Invalid preset id")
+    try:
+        ids = await run_dynamodb(preset_store.write, user_id, presets, delete_ids)
+        await bump_presets_revision(user_id)
+    except (BotoCoreError, ClientError) as e:
+        log_event("dynamodb_error", level=logging.ERROR, error=repr(e))
+        raise HTTPException(status_code=500, detail="Database error")
+    preset_stats["written"] += len(presets) + len(delete_ids)
+    return ids
+
+@application.get("/api/presets")
+async def list_presets(
+    request: Request,
+    limit: int = PRESET_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    q: str = "",
+    current_user: dict = Depends(get_current_user)
+):
+    """A page of the user's presets, newest first, optionally only those whose
+    name or amp contain q - PROTECTED. Each preset's settings are listed in
+    the order of "knobs"; pass "cursor" back for the next page."""
+    if not 1 <= limit <= PRESET_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {PRESET_PAGE_MAX}")
+    if cursor is not None and not valid_preset_id(cursor):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    user_id = current_user['user_id']
+    q = q.strip()[:100]
+    headers = {"Cache-Control": "private, no-cache", "Vary": "Authorization, Accept-Encoding"}
+    try:
+        revision = await load_presets_revision(user_id)
+        tag = f"{revision}-{zlib.crc32(f'{limit}|{cursor}|{q}'.encode()):08x}"
+        # Either encoding of the current listing counts as a match
+        if tag in request.headers.get("if-none-match", ""):
+            preset_stats["not_modified"] += 1
+            return Response(status_code=304, headers={**headers, "ETag": f'"{tag}"'})
+        presets, next_cursor = await run_dynamodb(preset_store.page, user_id, limit, cursor, q)
+    except (BotoCoreError, ClientError) as e:
+        log_event("dynamodb_error", level=logging.ERROR, error=repr(e))
+        raise HTTPException(status_code=500, detail="Database error")
+    
+    preset_stats["listed"] += 1
+    body = json.dumps(
+        {"knobs": KNOBS, "presets": presets, "cursor": next_cursor},
+        separators=(",", ":")
+    ).encode("utf-8")
+    if len(body) > 1024 and "gzip" in accepted_encodings(request.headers.get("accept-encoding", "")):
+        headers.update({"ETag": f'"{tag}-gzip"', "Content-Encoding": "gzip"})
+        return Response(gzip.compress(body, compresslevel=6), media_type="application/json", headers=headers)
+    return Response(body, media_type="application/json", headers={**headers, "ETag": f'"{tag}"'})
+
+@application.post("/api/presets", status_code=201)
+async def save_presets(request: PresetBatchRequest, current_user: dict = Depends(get_current_user)):
+    """Add and delete presets in one batch - PROTECTED"""
+    if not request.presets and not request.delete:
+        raise HTTPException(status_code=400, detail="No presets to save or delete")
+    presets = [preset.model_dump() for preset in request.presets]
+    ids = await write_presets(current_user['user_id'], presets, list(dict.fromkeys(request.delete)))
+    return {"created": ids, "deleted": len(request.delete)}
 
-print("=" * 60)
-print("BACKEND READY WITH AUTHENTICATION + SPOTIFY")
-print("=" * 60)
\ No newline at end of file
+@application.delete("/api/presets/{preset_id}", status_code=204)
+async def delete_preset(preset_id: str, current_user: dict = Depends(get_current_user)):
+    """Delete one preset - PROTECTED"""
+    await write_presets(current_user['user_id'], [], [preset_id])
+    return Response(status_code=204)
@@ -0,0 +1,149 @@
+# assets.py
+# In-memory static asset layer. At startup every file under static/ is read
+# once, fingerprinted and pre-compressed, and HTML pages get their
+# /static/... references rewritten to fingerprinted URLs, so:
+#   - fingerprinted and Vite-hashed assets are served with immutable caching
+#   - everything else is revalidated with a strong ETag (304 when unchanged)
+#   - the body is a pre-built gzip/brotli variant picked by Accept-Encoding
+# Files over ASSET_MAX_BYTES are streamed from disk instead, and revalidated.
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Optional
+
+from fastapi.responses import FileResponse, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_MAX_BYTES = int(os.getenv("ASSET_MAX_BYTES", str(2 * 1024 * 1024)))  # larger files are not held in memory
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# Vite output such as landing/assets/index-ezlJ0b5Z.css already has its hash
+# in the name. Only names in its output directory are trusted to; anything
+# else gets a ?v= fingerprint however it is named.
+BUNDLER_OUTPUT = "landing/assets/"
+HASHED_NAME = re.compile(r"-[A-Za-z0-9_-]{8}\.(?:js|css|woff2?|png|jpe?g|svg|webp)$")
+STATIC_REFERENCE = re.compile(r'((?:src|href)=")/static/([^"?#]+)(")')
+
+class Asset:
+    __slots__ = ("content_type", "digest", "variants", "hashed_name")
+
+    def __init__(self, content_type: str, body: bytes, hashed_name: bool):
+        self.content_type = content_type
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        self.hashed_name = hashed_name
+        self.variants = {"identity": body}  # encoding -> body
+        if len(body) > 256 and content_type.startswith(COMPRESSIBLE_TYPES):
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11)
+            # Drop variants that did not come out smaller
+            for encoding in [e for e in self.variants if e != "identity"]:
+                if len(self.variants[encoding]) >= len(body):
+                    del self.variants[encoding]
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.digest}"' if encoding == "identity" else f'"{self.digest}-{encoding}"'
+
+def accepted_encodings(accept_encoding: str) -> set:
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+class AssetStore:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.assets = {}  # path relative to directory -> Asset
+        self.large_files = {}  # path relative to directory -> full path, for files not held in memory
+
+    def load(self):
+        """Read, fingerprint and compress every file (blocking; call off the event loop)"""
+        assets = {}
+        large_files = {}
+        html = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                full_path = os.path.join(root, name)
+                path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                if os.path.getsize(full_path) > ASSET_MAX_BYTES:
+                    large_files[path] = full_path
+                    continue
+                with open(full_path, "rb") as f:
+                    body = f.read()
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                if content_type.startswith("text/") or content_type == "application/javascript":
+                    content_type += "; charset=utf-8"
+                if content_type.startswith("text/html"):
+                    html[path] = (content_type, body)
+                else:
+                    hashed_name = path.startswith(BUNDLER_OUTPUT) and bool(HASHED_NAME.search(name))
+                    assets[path] = Asset(content_type, body, hashed_name)
+
+        # Pages are fingerprinted last, so their links can carry the asset hashes
+        for path, (content_type, body) in html.items():
+            assets[path] = Asset(content_type, self.fingerprint_links(body, assets), False)
+        self.assets = assets
+        self.large_files = large_files
+
+    def fingerprint_links(self, body: bytes, assets: dict) -> bytes:
+        def with_version(match):
+            asset = assets.get(match.group(2))
+            if asset is None or asset.hashed_name:
+                return match.group(0)
+            return f"{match.group(1)}/static/{match.group(2)}?v={asset.digest}{match.group(3)}"
+
+        return STATIC_REFERENCE.sub(with_version, body.decode("utf-8")).encode("utf-8")
+
+    def response(self, path: str, headers, version: Optional[str] = None) -> Optional[Response]:
+        """Response for an asset given the request headers, or None if unknown.
+
+        version is the ?v= fingerprint from the URL; when it matches the
+        current content the response may be cached forever.
+        """
+        asset = self.assets.get(path)
+        if asset is None:
+            full_path = self.large_files.get(path)
+            return self.file_response(full_path, headers) if full_path is not None else None
+
+        accepted = accepted_encodings(headers.get("accept-encoding", ""))
+        encoding = next((e for e in ("br", "gzip") if e in asset.variants and e in accepted), "identity")
+        immutable = asset.hashed_name or version == asset.digest
+        response_headers = {
+            "ETag": asset.etag(encoding),
+            "Cache-Control": IMMUTABLE if immutable else REVALIDATE,
+            "Vary": "Accept-Encoding",
+        }
+
+        # Any variant of the current content counts as a match
+        if_none_match = headers.get("if-none-match", "")
+        if if_none_match and (if_none_match.strip() == "*" or asset.digest in if_none_match):
+            return Response(status_code=304, headers=response_headers)
+
+        if encoding != "identity":
+            response_headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], media_type=asset.content_type, headers=response_headers)
+
+    def file_response(self, full_path: str, headers) -> Optional[Response]:
+        """Response for a file too large to hold in memory, with FileResponse's
+        mtime and size ETag (blocking stat; call off the event loop)"""
+        try:
+            stat = os.stat(full_path)
+        except FileNotFoundError:
+            return None
+        response = FileResponse(full_path, stat_result=stat, headers={"Cache-Control": REVALIDATE})
+        etag = response.headers["etag"]
+        if etag in headers.get("if-none-match", ""):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
+        return response
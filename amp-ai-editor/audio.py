@@ -0,0 +1,119 @@
+# audio.py
+# Audio snippet analysis for /api/audio/features. Uploads are spooled to
+# memory and, past a size, to a temp file on disk; extract_features() then
+# decodes and analyses them in a worker process (librosa is imported there,
+# never in the web process). The features are described in the amp settings
+# prompt and bucketed into words for the local predictor.
+import io
+import os
+import tempfile
+from typing import Union
+
+# Seconds of audio decoded and analysed, from the start of the snippet
+AUDIO_ANALYSIS_SECONDS = float(os.getenv("AUDIO_ANALYSIS_SECONDS", "60"))
+AUDIO_SAMPLE_RATE = 22050
+
+class AudioSpool:
+    """Write-only buffer that keeps up to max_memory bytes in memory and
+    moves to a named temp file beyond that, so a worker process can open it
+    by path instead of receiving the bytes"""
+
+    def __init__(self, max_memory: int):
+        self.max_memory = max_memory
+        self.buffer = io.BytesIO()
+        self.file = None
+        self.size = 0
+
+    def write(self, chunk: bytes):
+        if self.file is None and self.size + len(chunk) > self.max_memory:
+            self.file = tempfile.NamedTemporaryFile(prefix="ampai-audio-", delete=False)
+            self.file.write(self.buffer.getbuffer())
+            self.buffer = None
+        (self.file or self.buffer).write(chunk)
+        self.size += len(chunk)
+
+    def source(self) -> Union[str, bytes]:
+        """What to hand extract_features(): the file path, or the bytes if small"""
+        if self.file is not None:
+            self.file.flush()
+            return self.file.name
+        return self.buffer.getvalue()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            os.unlink(self.file.name)
+
+def extract_features(source: Union[str, bytes]) -> dict:
+    """Decode an audio snippet (a path or the file's bytes) and measure it.
+    Runs in a worker process. Raises ValueError if it cannot be decoded."""
+    import librosa
+    import numpy as np
+
+    try:
+        y, sr = librosa.load(
+            io.BytesIO(source) if isinstance(source, bytes) else source,
+            sr=AUDIO_SAMPLE_RATE,
+            mono=True,
+            duration=AUDIO_ANALYSIS_SECONDS
+        )
+    except Exception:
+        raise ValueError("Could not decode audio; send a WAV, FLAC, OGG or MP3 file")
+    if y.size < sr // 2:
+        raise ValueError("Audio snippet is shorter than half a second")
+
+    # One STFT shared by the spectral features
+    spectrum = np.abs(librosa.stft(y))
+    rms = librosa.feature.rms(S=spectrum)[0]
+    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+    peak = float(np.max(np.abs(y)))
+    mean_rms = float(np.sqrt(np.mean(y ** 2)))
+
+    return {
+        "duration_seconds": round(y.size / sr, 2),
+        "tempo_bpm": round(float(np.atleast_1d(tempo)[0]), 1),
+        "spectral_centroid_hz": round(float(np.mean(librosa.feature.spectral_centroid(S=spectrum, sr=sr))), 1),
+        "rms_db": round(float(20 * np.log10(max(np.mean(rms), 1e-10))), 2),
+        # Distortion proxies: heavy clipping and compression flatten the peaks
+        # (low crest factor), and saturation adds noise-like harmonics (high flatness)
+        "crest_factor_db": round(float(20 * np.log10(max(peak, 1e-10) / max(mean_rms, 1e-10))), 2),
+        "spectral_flatness": round(float(np.mean(librosa.feature.spectral_flatness(S=spectrum))), 4),
+        "zero_crossing_rate": round(float(np.mean(librosa.feature.zero_crossing_rate(y))), 4),
+        "clipping_ratio": round(float(np.mean(np.abs(y) >= 0.99)), 5),
+    }
+
+def warm_up() -> int:
+    """Import librosa and compile its JIT-compiled paths on a second of
+    synthetic audio, which otherwise costs the first upload several seconds;
+    returns the worker's pid"""
+    import numpy as np
+    import soundfile
+
+    t = np.arange(AUDIO_SAMPLE_RATE) / AUDIO_SAMPLE_RATE
+    snippet = io.BytesIO()
+    soundfile.write(snippet, 0.5 * np.sin(2 * np.pi * 110 * t), AUDIO_SAMPLE_RATE, format="WAV")
+    extract_features(snippet.getvalue())
+    return os.getpid()
+
+def describe_features(features: dict) -> str:
+    """One line for the prompt"""
+    return (
+        f"tempo {features['tempo_bpm']:.0f} BPM, "
+        f"spectral centroid {features['spectral_centroid_hz']:.0f} Hz, "
+        f"RMS level {features['rms_db']:.1f} dBFS, "
+        f"crest factor {features['crest_factor_db']:.1f} dB, "
+        f"spectral flatness {features['spectral_flatness']:.3f}, "
+        f"{features['clipping_ratio'] * 100:.2f}% clipped samples"
+    )
+
+def feature_words(features: dict) -> list:
+    """Coarse buckets of the features, as words for the predictor, so songs
+    that sound alike share words the way songs by one artist do"""
+    return [
+        f"tempo{int(features['tempo_bpm'] // 20) * 20}",
+        f"centroid{int(features['spectral_centroid_hz'] // 500) * 500}",
+        f"rms{int(features['rms_db'] // 6) * 6}",
+        f"crest{int(features['crest_factor_db'] // 3) * 3}",
+        f"flatness{min(int(features['spectral_flatness'] * 20), 10)}",
+        "clipped" if features["clipping_ratio"] > 0.001 else "clean",
+    ]
@@ -0,0 +1,158 @@
+# bench/fake_services.py
+# Local stand-ins for the paid services application.py calls, so it can be
+# load tested offline:
+#   - OpenAI chat completions (POST /v1/chat/completions), plain or streamed
+#   - Spotify client-credentials token (POST /api/token) and track search
+#     (GET /v1/search) over a synthetic catalog
+#
+#   python bench/fake_services.py --port 9100 --openai-latency 0.8
+#
+# --openai-slow-share makes that share of completions take --openai-slow-latency
+# instead, the long tail that request hedging and deadlines are for.
+#
+# Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:9100/v1,
+# SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:9100 and SPOTIFY_API_URL=http://127.0.0.1:9100.
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import zlib
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+KNOBS = ["gain", "volume", "bass", "treble", "presence", "master"]
+
+WORDS = [
+    "love", "night", "heart", "fire", "road", "blue", "dream", "light", "rain", "wild",
+    "black", "summer", "highway", "queen", "stone", "electric", "sweet", "child", "crazy", "train",
+    "golden", "river", "thunder", "paradise", "smoke", "water", "angel", "devil", "city", "moon",
+]
+ARTISTS = [
+    "Metallica", "Fleetwood Mac", "Led Zeppelin", "Nirvana", "The Black Keys", "Queen",
+    "AC/DC", "Radiohead", "Pink Floyd", "Foo Fighters", "Pearl Jam", "The Strokes",
+]
+
+def make_catalog(size: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    tracks = []
+    for i in range(size):
+        name = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3))).title()
+        artist = rng.choice(ARTISTS)
+        tracks.append({
+            "id": f"track{i:06d}",
+            "name": name,
+            "uri": f"spotify:track:track{i:06d}",
+            "popularity": rng.randint(0, 100),
+            "artists": [{"name": artist}],
+            "album": {"name": f"{artist} Vol. {rng.randint(1, 9)}", "images": []},
+        })
+    return tracks
+
+def knob_values(seed_text: str) -> dict:
+    rng = random.Random(zlib.crc32(seed_text.encode()))
+    return {knob: rng.randint(10, 90) for knob in KNOBS}
+
+def create_app(openai_latency: float, stream_chunk_delay: float, spotify_latency: float,
+               catalog_size: int, openai_slow_share: float = 0.0, openai_slow_latency: float = 10.0) -> FastAPI:
+    app = FastAPI()
+    catalog = make_catalog(catalog_size)
+    catalog_words = [
+        set(re.findall(r"[a-z0-9]+", (t["name"] + " " + t["artists"][0]["name"]).lower()))
+        for t in catalog
+    ]
+
+    @app.get("/health")
+    def health():
+        return {"status": "healthy"}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        songs = re.findall(r"^\d+\. (.*)$", prompt, flags=re.MULTILINE)
+        if songs:
+            content = json.dumps({str(n): knob_values(song) for n, song in enumerate(songs, start=1)})
+        else:
+            content = json.dumps(knob_values(prompt))
+        created = int(time.time())
+        latency = openai_slow_latency if random.random() < openai_slow_share else openai_latency
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return JSONResponse({
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": created,
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 60, "completion_tokens": 40, "total_tokens": 100},
+            })
+
+        async def chunks():
+            # Time to first token is most of the latency; the rest trickles in
+            await asyncio.sleep(max(latency - stream_chunk_delay * len(content) / 4, 0))
+            for start in range(0, len(content), 4):
+                chunk = {
+                    "id": "chatcmpl-bench",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": body.get("model", "gpt-4o-mini"),
+                    "choices": [{"index": 0, "delta": {"content": content[start:start + 4]}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(stream_chunk_delay)
+            done = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get("model", "gpt-4o-mini"),
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    @app.post("/api/token")
+    async def spotify_token():
+        await asyncio.sleep(spotify_latency)
+        return {"access_token": "bench-token", "token_type": "Bearer", "expires_in": 3600}
+
+    @app.get("/v1/search")
+    async def spotify_search(q: str, limit: int = 10):
+        await asyncio.sleep(spotify_latency)
+        words = re.findall(r"[a-z0-9]+", q.lower())
+        matches = [
+            track for track, track_words in zip(catalog, catalog_words)
+            if all(any(w.startswith(word) for w in track_words) for word in words)
+        ]
+        matches.sort(key=lambda t: t["popularity"], reverse=True)
+        return {"tracks": {"items": matches[:limit], "total": len(matches)}}
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--openai-latency", type=float, default=0.8, help="seconds per completion")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.02, help="seconds between streamed chunks")
+    parser.add_argument("--spotify-latency", type=float, default=0.08, help="seconds per Spotify call")
+    parser.add_argument("--catalog-size", type=int, default=5000)
+    parser.add_argument("--openai-slow-share", type=float, default=0.0, help="share of completions that are slow")
+    parser.add_argument("--openai-slow-latency", type=float, default=10.0, help="seconds per slow completion")
+    args = parser.parse_args()
+
+    app = create_app(args.openai_latency, args.stream_chunk_delay, args.spotify_latency, args.catalog_size,
+                     args.openai_slow_share, args.openai_slow_latency)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
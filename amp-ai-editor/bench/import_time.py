@@ -0,0 +1,66 @@
+# bench/import_time.py
+# Import-time budget for application.py. Every serving process (and every
+# scale-out instance) pays it before it can answer a request, so nothing
+# slow should run at import; clients and pools are built in lifespan.
+#
+#   python bench/import_time.py [--runs 5] [--budget 1.5] [--top 10]
+#
+# Imports the app in fresh interpreters, prints the median wall time and the
+# slowest top-level imports (python -X importtime), and exits 1 when the
+# median is over budget.
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+def import_once() -> tuple:
+    """Returns (wall seconds, {top-level module: cumulative seconds}, app body seconds)"""
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "bench"))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import time; start = time.perf_counter(); import application; print(time.perf_counter() - start)"],
+        cwd=APP_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    modules = {}
+    body = 0.0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        if name == "application":
+            body = int(self_us) / 1e6
+        elif len(indent) == 3:  # imported directly by application.py
+            modules[name] = int(cumulative_us) / 1e6
+    return float(result.stdout.strip().splitlines()[-1]), modules, body
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.5, help="seconds allowed for the median import")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [import_once() for _ in range(args.runs)]
+    wall = statistics.median(run[0] for run in runs)
+    body = statistics.median(run[2] for run in runs)
+    names = set().union(*(run[1] for run in runs))
+    modules = {name: statistics.median(run[1].get(name, 0.0) for run in runs) for name in names}
+
+    print(f"import application:            {wall * 1000:7.1f} ms median of {args.runs} (budget {args.budget * 1000:.0f} ms)")
+    print(f"  module body:                 {body * 1000:7.1f} ms")
+    for name, seconds in sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {name:<28} {seconds * 1000:7.1f} ms")
+
+    if wall > args.budget:
+        print("over budget")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+# bench/load_test.py
+# Offline load test for application.py. Starts bench/fake_services.py (fake
+# OpenAI + Spotify) and bench/serve_app.py (the app on in-memory tables), then
+# drives each scenario at each concurrency level with closed-loop clients and
+# reports per-endpoint latency percentiles, throughput and event-loop lag.
+#
+#   python bench/load_test.py --scenarios mix,search --concurrency 1,16,64 --duration 10
+#   python bench/load_test.py --output after.json --compare before.json
+#
+# Results are written as JSON (--output) so runs on different commits can be
+# compared with --compare.
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+from fake_services import make_catalog  # noqa: E402
+
+SCENARIOS = {
+    "mix": {"search": 60, "generate": 15, "generate_stream": 5, "login": 15, "signup": 5},
+    "search": {"search": 1},
+    "generate": {"generate": 1},
+    "generate_stream": {"generate_stream": 1},
+    "login": {"login": 1},
+    "signup": {"signup": 1},
+}
+
+PASSWORD = "bench-password"
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start(args: list, log_path: str) -> subprocess.Popen:
+    log = open(log_path, "w")
+    return subprocess.Popen([sys.executable] + args, stdout=log, stderr=subprocess.STDOUT)
+
+async def wait_until_up(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+class Workload:
+    """Requests shaped like real traffic: a few very popular songs and a long
+    tail, searched by prefix as if typed, for a pool of existing users"""
+
+    def __init__(self, catalog: list, songs: int, seed: int):
+        self.rng = random.Random(seed)
+        by_popularity = sorted(catalog, key=lambda t: t["popularity"], reverse=True)[:songs]
+        self.songs = by_popularity
+        self.song_weights = list(itertools.accumulate(1.0 / (rank + 1) ** 1.1 for rank in range(len(self.songs))))
+        self.users = []
+        self.tokens = []
+
+    def song(self) -> dict:
+        return self.rng.choices(self.songs, cum_weights=self.song_weights)[0]
+
+    def song_request(self) -> dict:
+        track = self.song()
+        return {
+            "song_name": track["name"],
+            "artist": track["artists"][0]["name"],
+            "album": track["album"]["name"],
+            "spotify_id": track["id"],
+            "desired_tone": "authentic to the original recording",
+        }
+
+    def search_query(self) -> str:
+        name = self.song()["name"]
+        return name[:self.rng.randint(2, len(name))] if len(name) > 2 else name
+
+async def signup(client, workload, record):
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    start = time.perf_counter()
+    response = await client.post("/api/signup", json={"email": email, "password": PASSWORD, "name": "Bench"})
+    record("signup", time.perf_counter() - start, response.status_code)
+    if response.status_code == 200:
+        workload.users.append(email)
+        workload.tokens.append(response.json()["token"])
+
+async def login(client, workload, record):
+    email = workload.rng.choice(workload.users)
+    start = time.perf_counter()
+    response = await client.post("/api/login", json={"email": email, "password": PASSWORD})
+    record("login", time.perf_counter() - start, response.status_code)
+
+async def search(client, workload, record):
+    start = time.perf_counter()
+    response = await client.get("/api/spotify/search", params={"q": workload.search_query()})
+    record("search", time.perf_counter() - start, response.status_code)
+
+async def generate(client, workload, record):
+    headers = {"Authorization": f"Bearer {workload.rng.choice(workload.tokens)}"}
+    start = time.perf_counter()
+    response = await client.post("/api/get_amp_settings", json=workload.song_request(), headers=headers)
+    record("generate", time.perf_counter() - start, response.status_code)
+
+async def generate_stream(client, workload, record):
+    headers = {"Authorization": f"Bearer {workload.rng.choice(workload.tokens)}"}
+    start = time.perf_counter()
+    first_knob = None
+    async with client.stream("POST", "/api/get_amp_settings/stream",
+                             json=workload.song_request(), headers=headers) as response:
+        async for line in response.aiter_lines():
+            if first_knob is None and line.startswith("event: knob"):
+                first_knob = time.perf_counter() - start
+    record("generate_stream", time.perf_counter() - start, response.status_code)
+    if first_knob is not None:
+        record("generate_stream_first_knob", first_knob, response.status_code)
+
+OPERATIONS = {
+    "signup": signup,
+    "login": login,
+    "search": search,
+    "generate": generate,
+    "generate_stream": generate_stream,
+}
+
+async def run_phase(base_url: str, workload: Workload, scenario: str, concurrency: int, duration: float) -> dict:
+    mix = SCENARIOS[scenario]
+    names = list(mix)
+    weights = list(itertools.accumulate(mix[name] for name in names))
+    latencies = {}
+    statuses = {}
+
+    def record(name, seconds, status):
+        latencies.setdefault(name, []).append(seconds)
+        statuses.setdefault(name, {}).setdefault(str(status), 0)
+        statuses[name][str(status)] += 1
+
+    limits = httpx.Limits(max_connections=concurrency + 4, max_keepalive_connections=concurrency + 4)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        await client.get("/__bench/lag", params={"reset": True})
+        deadline = time.perf_counter() + duration
+
+        async def client_loop():
+            while time.perf_counter() < deadline:
+                name = workload.rng.choices(names, cum_weights=weights)[0]
+                try:
+                    await OPERATIONS[name](client, workload, record)
+                except httpx.HTTPError as e:
+                    record(name, 0.0, type(e).__name__)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+        lag = (await client.get("/__bench/lag", params={"reset": True})).json()
+
+    endpoints = {}
+    for name, values in latencies.items():
+        values.sort()
+        ok = statuses[name].get("200", 0)
+        endpoints[name] = {
+            "requests": len(values),
+            "ok": ok,
+            "statuses": statuses[name],
+            "throughput_rps": ok / elapsed,
+            "mean_ms": sum(values) / len(values) * 1000,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+        }
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "endpoints": endpoints,
+        "event_loop_lag": lag,
+    }
+
+def print_phase(phase: dict):
+    lag = phase["event_loop_lag"]
+    print(f"\n{phase['scenario']} @ {phase['concurrency']} clients "
+          f"(loop lag p50 {lag.get('p50_ms', 0):.1f} ms, p99 {lag.get('p99_ms', 0):.1f} ms, "
+          f"max {lag.get('max_ms', 0):.1f} ms)")
+    print(f"  {'endpoint':28s} {'req/s':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'errors':>7s}")
+    for name, stats in sorted(phase["endpoints"].items()):
+        print(f"  {name:28s} {stats['throughput_rps']:8.1f} {stats['p50_ms']:9.1f} "
+              f"{stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f} {stats['requests'] - stats['ok']:7d}")
+
+def print_comparison(before: dict, after: dict):
+    """p95 latency and throughput of this run against an earlier results file"""
+    earlier = {(p["scenario"], p["concurrency"]): p for p in before["phases"]}
+    print(f"\nCompared with {before.get('commit', '?')[:10]} ({before.get('timestamp', '?')}):")
+    for phase in after["phases"]:
+        old = earlier.get((phase["scenario"], phase["concurrency"]))
+        if old is None:
+            continue
+        for name, stats in sorted(phase["endpoints"].items()):
+            old_stats = old["endpoints"].get(name)
+            if old_stats is None:
+                continue
+            p95_change = (stats["p95_ms"] / old_stats["p95_ms"] - 1) * 100 if old_stats["p95_ms"] else 0.0
+            rps_change = (stats["throughput_rps"] / old_stats["throughput_rps"] - 1) * 100 if old_stats["throughput_rps"] else 0.0
+            print(f"  {phase['scenario']}@{phase['concurrency']:<4d} {name:28s} "
+                  f"p95 {old_stats['p95_ms']:8.1f} -> {stats['p95_ms']:8.1f} ms ({p95_change:+6.1f}%)  "
+                  f"req/s {old_stats['throughput_rps']:7.1f} -> {stats['throughput_rps']:7.1f} ({rps_change:+6.1f}%)")
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BENCH_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+async def run(args):
+    fake_port, app_port = free_port(), free_port()
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    processes = [
+        start([os.path.join(BENCH_DIR, "fake_services.py"), "--port", str(fake_port),
+               "--openai-latency", str(args.openai_latency),
+               "--openai-slow-share", str(args.openai_slow_share),
+               "--openai-slow-latency", str(args.openai_slow_latency),
+               "--spotify-latency", str(args.spotify_latency),
+               "--catalog-size", str(args.catalog_size)], args.log_prefix + "fakes.log"),
+        start([os.path.join(BENCH_DIR, "serve_app.py"), "--port", str(app_port), "--fake-url", fake_url,
+               "--dynamodb-latency", str(args.dynamodb_latency)], args.log_prefix + "app.log"),
+    ]
+    try:
+        await wait_until_up(f"{fake_url}/health")
+        await wait_until_up(f"{app_url}/health")
+
+        workload = Workload(make_catalog(args.catalog_size), args.songs, args.seed)
+        async with httpx.AsyncClient(base_url=app_url, timeout=120.0) as client:
+            await asyncio.gather(*[signup(client, workload, lambda *a: None) for _ in range(args.users)])
+        if not workload.tokens:
+            raise RuntimeError("Could not create any bench users, see the app log")
+
+        phases = []
+        for scenario in args.scenarios.split(","):
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                phase = await run_phase(app_url, workload, scenario, concurrency, args.duration)
+                print_phase(phase)
+                phases.append(phase)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "log_prefix")},
+        "phases": phases,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default="mix,search,generate,login",
+                        help=f"comma-separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32,64", help="comma-separated client counts")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per phase")
+    parser.add_argument("--users", type=int, default=20, help="accounts created before the run")
+    parser.add_argument("--songs", type=int, default=500, help="distinct songs requested")
+    parser.add_argument("--catalog-size", type=int, default=5000, help="tracks in the fake Spotify")
+    parser.add_argument("--openai-latency", type=float, default=0.8)
+    parser.add_argument("--openai-slow-share", type=float, default=0.0, help="share of slow OpenAI completions")
+    parser.add_argument("--openai-slow-latency", type=float, default=10.0)
+    parser.add_argument("--spotify-latency", type=float, default=0.08)
+    parser.add_argument("--dynamodb-latency", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--log-prefix", default="bench_", help="prefix for the fakes/app log files")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
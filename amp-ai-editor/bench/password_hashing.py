@@ -0,0 +1,59 @@
+# bench/password_hashing.py
+# Login throughput for the password check alone, run the way application.py
+# runs it: N concurrent logins from an event loop, verified in a process pool.
+#
+#   python bench/password_hashing.py [--logins 40] [--rounds 12]
+#
+# Throughput should grow with the number of workers up to the core count.
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost (BCRYPT_ROUNDS)")
+    args = parser.parse_args()
+
+    # Workers read BCRYPT_ROUNDS when they import passwords.py
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import passwords
+
+    hashed = passwords.hash_password("correct horse battery staple")
+    cores = os.cpu_count() or 1
+    print(f"bcrypt cost {args.rounds}, {args.logins} logins, {cores} cores")
+
+    start = time.perf_counter()
+    for _ in range(args.logins):
+        passwords.verify_and_update("correct horse battery staple", hashed)
+    inline = args.logins / (time.perf_counter() - start)
+    print(f"  inline (blocks the event loop): {inline:7.1f} logins/s")
+
+    workers = 1
+    while workers <= cores:
+        rate = asyncio.run(run_pool(passwords.verify_and_update, hashed, workers, args.logins))
+        print(f"  {workers:2d} worker process(es):          {rate:7.1f} logins/s  ({rate / inline:.1f}x)")
+        workers *= 2
+
+async def run_pool(fn, hashed, workers, logins):
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    loop = asyncio.get_running_loop()
+    try:
+        # Warm the workers up so process start-up is not measured
+        await asyncio.gather(*[loop.run_in_executor(pool, fn, "x", hashed) for _ in range(workers)])
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            loop.run_in_executor(pool, fn, "correct horse battery staple", hashed)
+            for _ in range(logins)
+        ])
+        return logins / (time.perf_counter() - start)
+    finally:
+        pool.shutdown()
+
+if __name__ == "__main__":
+    main()
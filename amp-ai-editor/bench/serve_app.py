@@ -0,0 +1,82 @@
+# bench/serve_app.py
+# Runs application.py under uvicorn against bench/fake_services.py, with
+# MemoryTable stand-ins for the DynamoDB tables and an event-loop lag probe
+# reported at /__bench/lag. Started by bench/load_test.py; run it by hand with
+#
+#   python bench/serve_app.py --port 9200 --fake-url http://127.0.0.1:9100
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class LagProbe:
+    """Measures how late the event loop wakes a task that sleeps interval seconds"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self.task = None
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    def summary(self) -> dict:
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0}
+        pick = lambda q: samples[min(int(q * len(samples)), len(samples) - 1)] * 1000
+        return {
+            "samples": len(samples),
+            "p50_ms": pick(0.50),
+            "p99_ms": pick(0.99),
+            "max_ms": samples[-1] * 1000,
+        }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--fake-url", default="http://127.0.0.1:9100")
+    parser.add_argument("--dynamodb-latency", type=float, default=0.005, help="seconds per table call")
+    # A few accounts drive the whole load, so per-user limits are off unless asked for
+    parser.add_argument("--user-rate", type=float, default=0, help="generations per user per minute, 0 for no limit")
+    args = parser.parse_args()
+
+    os.environ["OPENAI_API_KEY"] = "bench"
+    os.environ["OPENAI_BASE_URL"] = f"{args.fake_url}/v1"
+    os.environ["SPOTIFY_CLIENT_ID"] = "bench"
+    os.environ["SPOTIFY_CLIENT_SECRET"] = "bench"
+    os.environ["SPOTIFY_ACCOUNTS_URL"] = args.fake_url
+    os.environ["SPOTIFY_API_URL"] = args.fake_url
+    os.environ["USER_GENERATE_RATE_PER_MINUTE"] = str(args.user_rate)
+
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    import uvicorn
+    import application
+    from memory_table import MemoryTable
+
+    application.users_table = MemoryTable('userId', indexes={'email-index': 'email'}, latency=args.dynamodb_latency)
+    application.recommendations_table = MemoryTable('cacheKey', latency=args.dynamodb_latency)
+    application.preset_store.table = MemoryTable('userId', range_key='presetId', latency=args.dynamodb_latency)
+
+    probe = LagProbe()
+
+    @application.application.get("/__bench/lag")
+    async def bench_lag(reset: bool = False):
+        if probe.task is None:
+            probe.task = asyncio.ensure_future(probe.run())
+        summary = probe.summary()
+        if reset:
+            probe.samples = []
+        return summary
+
+    uvicorn.run(application.application, host="127.0.0.1", port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# catalog.py
+# Local autocomplete for /api/spotify/search: every Spotify track seen in a
+# search response, indexed by the prefixes of the words in its title and
+# artists. application.py decides when a query can be answered from here.
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Optional
+
+def search_words(text: str) -> list:
+    """Lowercase, accent-free alphanumeric words of a title, artist or query"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return re.findall(r"[a-z0-9]+", text)
+
+def track_words(track: dict) -> set:
+    words = set(search_words(track.get("name", "")))
+    for artist in track.get("artists", []):
+        words.update(search_words(artist.get("name", "")))
+    return words
+
+class TrackCatalog:
+    """Spotify tracks seen in search responses, indexed by word prefix.
+
+    The index is a sorted list of (word, track_id) pairs, so every track with a
+    word starting with a prefix sits in one contiguous slice found by bisect.
+    Least recently seen tracks are dropped once max_tracks is reached.
+    """
+
+    def __init__(self, max_tracks: int):
+        self.max_tracks = max_tracks
+        self.tracks = OrderedDict()  # track id -> track object as returned by Spotify
+        self.index = []
+
+    def add(self, track: dict):
+        track_id = track.get("id")
+        if not track_id:
+            return
+        if track_id in self.tracks:
+            self.tracks[track_id] = track
+            self.tracks.move_to_end(track_id)
+            return
+        self.tracks[track_id] = track
+        for word in track_words(track):
+            insort(self.index, (word, track_id))
+        while len(self.tracks) > self.max_tracks:
+            self.remove(next(iter(self.tracks)))
+
+    def remove(self, track_id: str):
+        track = self.tracks.pop(track_id)
+        for word in track_words(track):
+            i = bisect_left(self.index, (word, track_id))
+            if i < len(self.index) and self.index[i] == (word, track_id):
+                del self.index[i]
+
+    def prefix_ids(self, prefix: str) -> set:
+        lo = bisect_left(self.index, (prefix,))
+        hi = bisect_left(self.index, (prefix + "\uffff",))
+        return {track_id for _, track_id in self.index[lo:hi]}
+
+    def search(self, words: list, limit: int, within: Optional[set] = None) -> list:
+        """Most popular tracks where every query word prefixes one of the track's words"""
+        ids = None if within is None else {i for i in within if i in self.tracks}
+        # Longer words match fewer tracks, so intersect those first
+        for word in sorted(words, key=len, reverse=True):
+            matched = self.prefix_ids(word)
+            ids = matched if ids is None else ids & matched
+            if not ids:
+                return []
+        ranked = sorted(ids, key=lambda i: self.tracks[i].get("popularity", 0), reverse=True)
+        return [self.tracks[i] for i in ranked[:limit]]
@@ -38,3 +38,56 @@ except Exception as e:
         print("2. Add the email-index manually via AWS Console")
     else:
         print(f"❌ Error: {e}")
+
+# Recommendation cache table (read/written by application.py, expires via TTL)
+try:
+    table = dynamodb.create_table(
+        TableName='ampai-recommendations',
+        KeySchema=[
+            {'AttributeName': 'cacheKey', 'KeyType': 'HASH'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'cacheKey', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+    print("⏳ Creating recommendations table...")
+    table.wait_until_exists()
+    dynamodb.meta.client.update_time_to_live(
+        TableName='ampai-recommendations',
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+    )
+    print("✅ Recommendations table created successfully!")
+
+except Exception as e:
+    if 'ResourceInUseException' in str(e):
+        print("⚠️  Table 'ampai-recommendations' already exists.")
+    else:
+        print(f"❌ Error: {e}")
+
+# Saved presets table (see presets.py): one small item per preset, listed by
+# user newest first
+try:
+    table = dynamodb.create_table(
+        TableName='ampai-presets',
+        KeySchema=[
+            {'AttributeName': 'userId', 'KeyType': 'HASH'},
+            {'AttributeName': 'presetId', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'userId', 'AttributeType': 'S'},
+            {'AttributeName': 'presetId', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+    print("⏳ Creating presets table...")
+    table.wait_until_exists()
+    print("✅ Presets table created successfully!")
+
+except Exception as e:
+    if 'ResourceInUseException' in str(e):
+        print("⚠️  Table 'ampai-presets' already exists.")
+    else:
+        print(f"❌ Error: {e}")
@@ -0,0 +1,421 @@
+# jobs.py
+# Queue of amp settings generation jobs, so a request can return a job id at
+# once and the work carries on in background workers (see application.py).
+# Jobs are idempotent by request key: submitting a song that is already
+# queued, running or recently done hands back the same job.
+#
+# Stores, picked by create_job_store(url):
+#   memory              this process only (the default with one web worker)
+#   sqlite:<path>       shared by every web worker on the instance
+#   redis://host:port   shared across instances (needs the redis package)
+#
+# A job is a dict: id, key, status (queued, running, done or failed), song,
+# settings (when done), error (when failed, {"status", "detail"}),
+# created_at and updated_at (epoch seconds).
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED = (DONE, FAILED)
+
+def new_job(key: str, song: dict) -> dict:
+    now = time.time()
+    return {
+        "id": uuid.uuid4().hex,
+        "key": key,
+        "status": QUEUED,
+        "song": song,
+        "settings": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+def reusable(job: Optional[dict], ttl_seconds: float, stale_seconds: Optional[float] = None) -> bool:
+    """Whether a new submission for the same key should attach to this job:
+    anything not failed, as long as a finished job is not older than the TTL
+    and, given stale_seconds, a running one has not been running longer
+    (which means its worker died)"""
+    if job is None or job["status"] == FAILED:
+        return False
+    if job["status"] == RUNNING and stale_seconds is not None:
+        return job["updated_at"] > time.time() - stale_seconds
+    return job["status"] != DONE or job["updated_at"] > time.time() - ttl_seconds
+
+class MemoryJobStore:
+    """Jobs in a dict, pending ids in an asyncio.Queue; event loop only"""
+
+    def __init__(self, ttl_seconds: float, max_jobs: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()  # job id -> job, oldest first
+        self.keys = {}  # request key -> id of its newest job
+        self.pending = asyncio.Queue()
+        self.finished = {}  # job id -> asyncio.Event set when it finishes
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = self.jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def find(self, key: str) -> Optional[dict]:
+        """The job a submission for this key would attach to, if any"""
+        job = self.jobs.get(self.keys.get(key))
+        return dict(job) if reusable(job, self.ttl_seconds) else None
+
+    async def submit(self, key: str, song: dict) -> Tuple[dict, bool]:
+        """The job for this key, and whether it was just created"""
+        job = await self.find(key)
+        if job is not None:
+            return job, False
+        self.prune()
+        job = new_job(key, song)
+        self.jobs[job["id"]] = job
+        self.keys[key] = job["id"]
+        self.pending.put_nowait(job["id"])
+        return dict(job), True
+
+    async def next(self) -> dict:
+        """Wait for a queued job and mark it running"""
+        while True:
+            job = self.jobs.get(await self.pending.get())
+            if job is not None and job["status"] == QUEUED:
+                job["status"] = RUNNING
+                job["updated_at"] = time.time()
+                return dict(job)
+
+    async def finish(self, job_id: str, settings: Optional[dict] = None, error: Optional[dict] = None):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.update(status=DONE if error is None else FAILED, settings=settings, error=error, updated_at=time.time())
+        event = self.finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """The job once it has finished, or as it is when timeout runs out"""
+        job = self.jobs.get(job_id)
+        if job is not None and job["status"] not in FINISHED:
+            event = self.finished.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return await self.get(job_id)
+
+    def prune(self):
+        """Drop finished jobs past the TTL, and the oldest finished ones over max_jobs"""
+        expired = time.time() - self.ttl_seconds
+        while self.jobs:
+            job_id, job = next(iter(self.jobs.items()))
+            if job["status"] not in FINISHED or (job["updated_at"] > expired and len(self.jobs) < self.max_jobs):
+                break
+            del self.jobs[job_id]
+            if self.keys.get(job["key"]) == job_id:
+                del self.keys[job["key"]]
+
+class SqliteJobStore:
+    """Jobs in a SQLite table that every process on the instance can claim
+    from. Queries run in a thread; other processes' submissions and results
+    are noticed by polling every poll_seconds. Only one worker per process
+    polls for jobs to claim, backing off to max_poll_seconds while idle."""
+
+    def __init__(self, path: str, ttl_seconds: float, stale_seconds: float = 120.0,
+                 poll_seconds: float = 0.25, max_poll_seconds: float = 2.0):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds  # running this long means its worker died
+        self.poll_seconds = poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.connection = None
+        self.lock = threading.Lock()
+        self.changed = None  # asyncio.Event set on local submits and results
+        self.claiming = None  # asyncio.Lock held by the worker polling claim()
+        self.last_prune = 0.0
+
+    async def start(self):
+        self.changed = asyncio.Event()
+        self.claiming = asyncio.Lock()
+        await asyncio.to_thread(self.connect)
+
+    async def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    def connect(self):
+        self.connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                key TEXT NOT NULL,
+                status TEXT NOT NULL,
+                song TEXT NOT NULL,
+                settings TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, created_at)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def wait_for_change(self, timeout: float, changed: Optional[asyncio.Event] = None) -> bool:
+        """Whether a local change arrived (since changed was taken) within timeout"""
+        try:
+            await asyncio.wait_for((changed or self.changed).wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    @staticmethod
+    def row_to_job(row) -> Optional[dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job["song"] = json.loads(job["song"])
+        job["settings"] = json.loads(job["settings"]) if job["settings"] else None
+        job["error"] = json.loads(job["error"]) if job["error"] else None
+        return job
+
+    def run(self, fn, *args):
+        with self.lock:
+            return fn(*args)
+
+    def select(self, job_id: str) -> Optional[dict]:
+        return self.row_to_job(self.connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await asyncio.to_thread(self.run, self.select, job_id)
+
+    def newest(self, key: str) -> Optional[dict]:
+        return self.row_to_job(self.connection.execute(
+            "SELECT * FROM jobs WHERE key = ? ORDER BY created_at DESC LIMIT 1", (key,)
+        ).fetchone())
+
+    async def find(self, key: str) -> Optional[dict]:
+        job = await asyncio.to_thread(self.run, self.newest, key)
+        return job if reusable(job, self.ttl_seconds) else None
+
+    def insert_unless_reusable(self, key: str, song: dict) -> Tuple[dict, bool]:
+        # IMMEDIATE takes the write lock up front, so two processes cannot
+        # both find no job for the key and insert one each
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            job = self.newest(key)
+            created = not reusable(job, self.ttl_seconds)
+            if created:
+                job = new_job(key, song)
+                self.connection.execute(
+                    "INSERT INTO jobs (id, key, status, song, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (job["id"], key, QUEUED, json.dumps(song), job["created_at"], job["updated_at"])
+                )
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        return job, created
+
+    async def submit(self, key: str, song: dict) -> Tuple[dict, bool]:
+        job, created = await asyncio.to_thread(self.run, self.insert_unless_reusable, key, song)
+        if created:
+            self.notify()
+            if time.time() - self.last_prune > 60:
+                self.last_prune = time.time()
+                await asyncio.to_thread(self.run, self.prune)
+        return job, created
+
+    def claim(self) -> Optional[dict]:
+        now = time.time()
+        row = self.connection.execute(
+            """
+            UPDATE jobs SET status = ?, updated_at = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = ? OR (status = ? AND updated_at < ?)
+                ORDER BY created_at LIMIT 1
+            )
+            RETURNING *
+            """,
+            (RUNNING, now, QUEUED, RUNNING, now - self.stale_seconds)
+        ).fetchone()
+        return self.row_to_job(row)
+
+    async def next(self) -> dict:
+        """Wait for a queued (or stale running) job and mark it running. The
+        other workers wait their turn on claiming rather than polling too"""
+        async with self.claiming:
+            poll_seconds = self.poll_seconds
+            while True:
+                changed = self.changed
+                job = await asyncio.to_thread(self.run, self.claim)
+                if job is not None:
+                    return job
+                if await self.wait_for_change(poll_seconds, changed):
+                    poll_seconds = self.poll_seconds
+                else:
+                    poll_seconds = min(poll_seconds * 2, self.max_poll_seconds)
+
+    def update(self, job_id: str, status: str, settings: Optional[dict], error: Optional[dict]):
+        self.connection.execute(
+            "UPDATE jobs SET status = ?, settings = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, json.dumps(settings) if settings is not None else None,
+             json.dumps(error) if error is not None else None, time.time(), job_id)
+        )
+
+    async def finish(self, job_id: str, settings: Optional[dict] = None, error: Optional[dict] = None):
+        status = DONE if error is None else FAILED
+        await asyncio.to_thread(self.run, self.update, job_id, status, settings, error)
+        self.notify()
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in FINISHED or remaining <= 0:
+                return job
+            await self.wait_for_change(min(self.poll_seconds, remaining))
+
+    def prune(self):
+        self.connection.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+            (DONE, FAILED, time.time() - self.ttl_seconds)
+        )
+
+class RedisJobStore:
+    """Jobs as JSON strings with a TTL, a list of pending ids, and a pub/sub
+    channel per job announcing that it finished. A job left running for
+    stale_seconds is failed on the next submission for its key, which starts
+    a new one, so a dead worker's jobs are not attached to until they expire."""
+
+    PREFIX = "ampai:jobs"
+
+    def __init__(self, url: str, ttl_seconds: float, stale_seconds: float = 120.0):
+        if aioredis is None:
+            raise RuntimeError("JOB_STORE is a Redis URL but the redis package is not installed")
+        self.redis = aioredis.from_url(url, decode_responses=True)
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds  # running this long means its worker died
+
+    async def start(self):
+        await self.redis.ping()
+
+    async def close(self):
+        await self.redis.aclose()
+
+    def job_key(self, job_id: str) -> str:
+        return f"{self.PREFIX}:job:{job_id}"
+
+    def request_key(self, key: str) -> str:
+        return f"{self.PREFIX}:key:{key}"
+
+    def channel(self, job_id: str) -> str:
+        return f"{self.PREFIX}:finished:{job_id}"
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        value = await self.redis.get(self.job_key(job_id))
+        return json.loads(value) if value is not None else None
+
+    async def save(self, job: dict):
+        await self.redis.set(self.job_key(job["id"]), json.dumps(job), ex=int(self.ttl_seconds))
+
+    async def find(self, key: str) -> Optional[dict]:
+        owner_id = await self.redis.get(self.request_key(key))
+        owner = await self.get(owner_id) if owner_id is not None else None
+        return owner if reusable(owner, self.ttl_seconds, self.stale_seconds) else None
+
+    async def submit(self, key: str, song: dict) -> Tuple[dict, bool]:
+        ttl = int(self.ttl_seconds)
+        job = new_job(key, song)
+        while True:
+            # The request key names the job that owns it; first writer wins
+            if await self.redis.set(self.request_key(key), job["id"], nx=True, ex=ttl):
+                await self.save(job)
+                await self.redis.rpush(f"{self.PREFIX}:pending", job["id"])
+                return job, True
+            owner_id = await self.redis.get(self.request_key(key))
+            if owner_id is None:
+                continue  # expired in between; try to claim it again
+            owner = await self.get(owner_id)
+            if reusable(owner, self.ttl_seconds, self.stale_seconds):
+                return owner, False
+            if owner is not None and owner["status"] == RUNNING:
+                # Its worker died: fail it, so anyone waiting on it stops
+                await self.finish(owner_id, error={"status": 500, "detail": "Job was lost, please submit it again"})
+            # Failed or lost: release the key, unless someone else just took it
+            async with self.redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(self.request_key(key))
+                if await pipe.get(self.request_key(key)) == owner_id:
+                    pipe.multi()
+                    pipe.delete(self.request_key(key))
+                    await pipe.execute()
+
+    async def next(self) -> dict:
+        while True:
+            _, job_id = await self.redis.blpop(f"{self.PREFIX}:pending")
+            job = await self.get(job_id)
+            if job is not None and job["status"] == QUEUED:
+                job.update(status=RUNNING, updated_at=time.time())
+                await self.save(job)
+                return job
+
+    async def finish(self, job_id: str, settings: Optional[dict] = None, error: Optional[dict] = None):
+        job = await self.get(job_id)
+        if job is None:
+            return
+        job.update(status=DONE if error is None else FAILED, settings=settings, error=error, updated_at=time.time())
+        await self.save(job)
+        await self.redis.publish(self.channel(job_id), job["status"])
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        pubsub = self.redis.pubsub()
+        try:
+            # Subscribe before reading the job, so a finish in between is not missed
+            await pubsub.subscribe(self.channel(job_id))
+            job = await self.get(job_id)
+            deadline = time.monotonic() + timeout
+            while job is not None and job["status"] not in FINISHED:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if message is not None:
+                    job = await self.get(job_id)
+            return job
+        finally:
+            await pubsub.aclose()
+
+def create_job_store(url: str, ttl_seconds: float):
+    if url.startswith(("redis://", "rediss://")):
+        return RedisJobStore(url, ttl_seconds)
+    if url.startswith("sqlite:"):
+        return SqliteJobStore(url[len("sqlite:"):], ttl_seconds)
+    if url == "memory":
+        return MemoryJobStore(ttl_seconds)
+    raise ValueError(f"Unknown JOB_STORE {url!r}")
@@ -0,0 +1,40 @@
+# knobs.py
+# Amp knob values as the API hands them out, whole numbers from 0 to 100, and
+# KnobStreamParser, which picks them out of a streamed OpenAI reply.
+import re
+
+from presets import KNOBS
+
+def clamp_knob(value) -> int:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        return 50
+    return int(round(min(max(value, 0), 100)))
+
+def clean_knobs(settings: dict) -> dict:
+    """Every knob as a whole number from 0 to 100; missing or garbled ones at 50"""
+    return {knob: clamp_knob(settings.get(knob)) for knob in KNOBS}
+
+class KnobStreamParser:
+    """Picks knob values out of a JSON object as it streams in.
+
+    A value counts as complete once the character after the number arrives
+    (a comma, brace or whitespace), so "gain": 7 is not reported before we
+    know it is not "gain": 75.
+    """
+
+    PATTERN = re.compile(r'"(' + "|".join(KNOBS) + r')"\s*:\s*(-?\d+(?:\.\d+)?)(?=[\s,}])')
+
+    def __init__(self):
+        self.text = ""
+        self.settings = {}
+
+    def feed(self, chunk: str) -> list:
+        """Add streamed text; returns the (knob, value) pairs completed by it"""
+        self.text += chunk
+        completed = []
+        for match in self.PATTERN.finditer(self.text):
+            key = match.group(1)
+            if key not in self.settings:
+                self.settings[key] = clamp_knob(float(match.group(2)))
+                completed.append((key, self.settings[key]))
+        return completed
@@ -0,0 +1,121 @@
+# memory_table.py
+# In-memory stand-in for a boto3 DynamoDB Table, for local runs and benchmarks.
+# Covers the calls application.py makes: get_item, put_item, update_item,
+# delete_item, batch_writer, scan, and query on the primary key or a global
+# secondary index, with simple "attr = :value" / "SET a = :a, b = :b"
+# expressions. Tables with a range key are queried by hash key in range key
+# order, with Limit, ExclusiveStartKey, ScanIndexForward and a
+# "contains(attr, :value)" FilterExpression applied after Limit, as DynamoDB does.
+import copy
+import threading
+import time
+
+class MemoryBatchWriter:
+    """What Table.batch_writer() returns; writes go straight to the table"""
+
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def put_item(self, Item, **kwargs):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key, **kwargs):
+        self.table.delete_item(Key=Key)
+
+class MemoryTable:
+    def __init__(self, key: str, indexes: dict = None, latency: float = 0.0, range_key: str = None):
+        """key is the hash key attribute, range_key the optional range key
+        attribute, indexes maps index name -> hash key attribute, latency is
+        slept on every call to mimic a network round trip"""
+        self.key = key
+        self.range_key = range_key
+        self.indexes = indexes or {}
+        self.latency = latency
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _item_key(self, key: dict):
+        if self.range_key is None:
+            return key[self.key]
+        return (key[self.key], key[self.range_key])
+
+    def get_item(self, Key, **kwargs):
+        self._wait()
+        with self.lock:
+            item = self.items.get(self._item_key(Key))
+            return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        self._wait()
+        with self.lock:
+            self.items[self._item_key(Item)] = copy.deepcopy(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, **kwargs):
+        self._wait()
+        assignments = UpdateExpression.strip()[len('SET'):].split(',')
+        with self.lock:
+            item = self.items.setdefault(self._item_key(Key), dict(Key))
+            for assignment in assignments:
+                attribute, placeholder = [part.strip() for part in assignment.split('=')]
+                item[attribute] = copy.deepcopy(ExpressionAttributeValues[placeholder])
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self._wait()
+        with self.lock:
+            self.items.pop(self._item_key(Key), None)
+        return {}
+
+    def batch_writer(self, **kwargs):
+        return MemoryBatchWriter(self)
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, IndexName=None,
+              Limit=None, ExclusiveStartKey=None, ScanIndexForward=True, FilterExpression=None, **kwargs):
+        self._wait()
+        attribute, placeholder = [part.strip() for part in KeyConditionExpression.split('=')]
+        expected = self.indexes[IndexName] if IndexName else self.key
+        if attribute != expected:
+            raise ValueError(f"Query condition must be on {expected}, got {attribute}")
+        value = ExpressionAttributeValues[placeholder]
+        with self.lock:
+            items = [copy.deepcopy(item) for item in self.items.values() if item.get(attribute) == value]
+
+        last_key = None
+        if self.range_key is not None and IndexName is None:
+            items.sort(key=lambda item: item[self.range_key], reverse=not ScanIndexForward)
+            if ExclusiveStartKey is not None:
+                start = ExclusiveStartKey[self.range_key]
+                items = [
+                    item for item in items
+                    if (item[self.range_key] > start if ScanIndexForward else item[self.range_key] < start)
+                ]
+            if Limit is not None and len(items) > Limit:
+                items = items[:Limit]
+                last_key = {self.key: value, self.range_key: items[-1][self.range_key]}
+
+        if FilterExpression is not None:
+            filter_attribute, filter_placeholder = FilterExpression.strip()[len('contains('):-1].split(',')
+            needle = ExpressionAttributeValues[filter_placeholder.strip()]
+            items = [item for item in items if needle in item.get(filter_attribute.strip(), '')]
+
+        response = {'Items': items, 'Count': len(items)}
+        if last_key is not None:
+            response['LastEvaluatedKey'] = last_key
+        return response
+
+    def scan(self, **kwargs):
+        self._wait()
+        with self.lock:
+            items = [copy.deepcopy(item) for item in self.items.values()]
+        return {'Items': items, 'Count': len(items)}
@@ -0,0 +1,151 @@
+# metrics.py
+# Latency histograms, per-stage timing spans and sampled structured logs,
+# rendered in the Prometheus text format by application.py at /metrics.
+import json
+import logging
+import os
+import random
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Optional
+
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))  # share of routine events logged
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(message)s")
+logger = logging.getLogger("ampai")
+
+# Seconds; covers a sub-millisecond cache hit up to a slow OpenAI completion
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Prometheus-style histogram with a fixed set of label names.
+
+    observe() is a bisect plus three increments; buckets are stored
+    per-bucket and only made cumulative when rendered.
+    """
+
+    def __init__(self, name: str, help_text: str, labels: tuple, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [per-bucket counts (+inf last), sum, count]
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self.series.items()):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+def render_counter(name: str, help_text: str, label: str, values: dict, kind: str = "counter") -> list:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for key, value in sorted(values.items()):
+        lines.append(f'{name}{{{label}="{key}"}} {value}')
+    return lines
+
+request_seconds = Histogram(
+    "ampai_request_duration_seconds",
+    "Time from request start to the end of the response body",
+    ("method", "route", "status")
+)
+stage_seconds = Histogram(
+    "ampai_stage_duration_seconds",
+    "Time spent in one stage of a request pipeline",
+    ("stage",)
+)
+
+class span:
+    """Times a block into stage_seconds: with span("openai"): ..."""
+
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_seconds.observe(time.perf_counter() - self.start, self.stage)
+        return False
+
+class LatencyWindow:
+    """The last size latencies of one kind of call, for percentiles that
+    follow the current behaviour of an upstream (histograms never forget)"""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """The q-quantile (0-1) of the window, or None while it is empty"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def __len__(self):
+        return len(self.samples)
+
+def log_event(event: str, sampled: bool = False, level: int = logging.INFO, **fields):
+    """Log one JSON line. Sampled events are kept with probability LOG_SAMPLE_RATE"""
+    if sampled and random.random() >= LOG_SAMPLE_RATE:
+        return
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({"event": event, **fields}, default=str))
+
+class TimingMiddleware:
+    """ASGI middleware recording every HTTP request in request_seconds, by
+    route template rather than raw path so label cardinality stays bounded"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            # Mounted apps have no route, but set root_path to the mount
+            route = getattr(scope.get("route"), "path", None) or scope.get("root_path") or "unmatched"
+            request_seconds.observe(elapsed, scope["method"], route, str(status))
+            log_event(
+                "request",
+                sampled=status < 500,
+                level=logging.INFO if status < 500 else logging.WARNING,
+                method=scope["method"],
+                route=route,
+                status=status,
+                ms=round(elapsed * 1000, 2)
+            )
@@ -0,0 +1,40 @@
+# passwords.py
+# Password hashing helpers. Kept out of application.py so worker processes
+# only import passlib, not the whole app, when they run these functions.
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+@lru_cache(maxsize=None)
+def pwd_context():
+    """The CryptContext, built on first use so importing this module stays cheap.
+    Hashes made with any other cost are re-hashed on the next successful login"""
+    from passlib.context import CryptContext
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=BCRYPT_ROUNDS,
+        bcrypt__min_rounds=BCRYPT_ROUNDS,
+        bcrypt__max_rounds=BCRYPT_ROUNDS
+    )
+
+def warm_up() -> int:
+    """Build the context ahead of the first login; returns the worker's pid"""
+    pwd_context()
+    return os.getpid()
+
+def hash_password(password: str) -> str:
+    return pwd_context().hash(password)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context().verify(plain_password, hashed_password)
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password; also returns a new hash if the stored one uses an old cost"""
+    return pwd_context().verify_and_update(plain_password, hashed_password)
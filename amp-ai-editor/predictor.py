@@ -0,0 +1,82 @@
+# predictor.py
+# Local nearest-neighbour predictor of amp settings, answering requests that
+# look like ones OpenAI has already answered (see PREDICTOR_MODE in
+# application.py). A request is anything with the FIELD_WEIGHTS attributes:
+# strings, and for audio_features None or an object with a words() method.
+import zlib
+from typing import Optional, Tuple
+
+import numpy as np
+
+from catalog import search_words
+from presets import KNOBS
+
+class AmpPredictor:
+    """Nearest-neighbour predictor over knob settings generated before.
+
+    Each past request becomes a hashed bag-of-words vector over its artist,
+    album, title, desired tone and the bucketed features of an uploaded audio
+    snippet (artist weighted highest), normalized so a
+    single matrix product gives the cosine similarity to every stored song.
+    The prediction is the similarity-weighted mean of the closest songs' knobs;
+    its confidence is their average similarity, with missing neighbours
+    counting as 0, so a handful of close matches is needed to be trusted.
+    Rows are reused oldest-first once max_size is reached.
+    """
+
+    DIMENSIONS = 512
+    FIELD_WEIGHTS = {"artist": 3.0, "album": 1.0, "song_name": 1.0, "desired_tone": 1.0, "audio_features": 2.0}
+
+    def __init__(self, max_size: int, neighbours: int):
+        self.max_size = max_size
+        self.neighbours = neighbours
+        self.features = np.zeros((max_size, self.DIMENSIONS), dtype=np.float32)
+        self.knobs = np.zeros((max_size, len(KNOBS)), dtype=np.float32)
+        self.rows = {}  # recommendation key -> row
+        self.row_keys = [None] * max_size
+        self.size = 0
+        self.next_row = 0
+
+    def featurize(self, request) -> Optional[np.ndarray]:
+        vector = np.zeros(self.DIMENSIONS, dtype=np.float32)
+        for field, weight in self.FIELD_WEIGHTS.items():
+            value = getattr(request, field)
+            if value is None:
+                continue
+            words = search_words(value) if isinstance(value, str) else value.words()
+            for word in words:
+                h = zlib.crc32(f"{field}:{word}".encode())
+                vector[h % self.DIMENSIONS] += weight if h & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def add(self, key: str, request, settings: dict):
+        vector = self.featurize(request)
+        if vector is None:
+            return
+        row = self.rows.get(key)
+        if row is None:
+            row = self.next_row
+            self.next_row = (self.next_row + 1) % self.max_size
+            self.size = min(self.size + 1, self.max_size)
+            if self.row_keys[row] is not None:
+                del self.rows[self.row_keys[row]]
+            self.rows[key] = row
+            self.row_keys[row] = key
+        self.features[row] = vector
+        self.knobs[row] = [settings[knob] for knob in KNOBS]
+
+    def predict(self, request) -> Optional[Tuple[dict, float]]:
+        """(settings, confidence) from the closest stored songs, or None"""
+        vector = self.featurize(request)
+        if vector is None or self.size == 0:
+            return None
+        similarity = self.features[:self.size] @ vector
+        k = min(self.neighbours, self.size)
+        nearest = np.argpartition(-similarity, k - 1)[:k]
+        weights = np.clip(similarity[nearest], 0.0, None)
+        if weights.sum() <= 0:
+            return None
+        knobs = weights @ self.knobs[nearest] / weights.sum()
+        settings = {knob: int(round(min(max(value, 0.0), 100.0))) for knob, value in zip(KNOBS, knobs)}
+        return settings, float(weights.sum() / self.neighbours)
@@ -0,0 +1,116 @@
+# presets.py
+# Saved amp presets, one item per preset in the ampai-presets DynamoDB table
+# (hash key userId, range key presetId; see create_table.py), or in a
+# MemoryTable for local runs. Items have a compact fixed schema, with short
+# attribute names since DynamoDB bills and caps item size by names and values:
+#   userId, presetId   keys; preset ids sort by creation time
+#   k                  the six knobs, one byte each (0-100), in KNOBS order
+#   n, a               preset name and amp
+#   s, r               song name and artist ("" if none)
+#   q                  accent-free lowercase "name\namp", for search
+#   t                  created at, epoch seconds
+# PresetStore calls are blocking boto3 calls; run them off the event loop.
+import time
+import unicodedata
+import uuid
+from typing import List, Optional, Tuple
+
+KNOBS = ["gain", "volume", "bass", "treble", "presence", "master"]
+
+# A query reads at most this many items per round trip while searching, since
+# DynamoDB applies Limit before FilterExpression
+SEARCH_READ_SIZE = 200
+
+def new_preset_id() -> str:
+    """Milliseconds since the epoch in fixed-width hex, then random bits, so
+    ids sort by creation time"""
+    return f"{int(time.time() * 1000):011x}{uuid.uuid4().hex[:8]}"
+
+def valid_preset_id(preset_id: str) -> bool:
+    return len(preset_id) == 19 and all(ch in "0123456789abcdef" for ch in preset_id)
+
+def search_text(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).strip()
+
+def pack_knobs(settings: dict) -> bytes:
+    return bytes(int(round(min(max(settings.get(knob, 50), 0), 100))) for knob in KNOBS)
+
+def unpack_knobs(packed) -> list:
+    """Knob values in KNOBS order; packed is bytes, or a boto3 Binary"""
+    return list(bytes(packed))
+
+def to_item(user_id: str, preset: dict) -> dict:
+    return {
+        "userId": user_id,
+        "presetId": new_preset_id(),
+        "k": pack_knobs(preset["settings"]),
+        "n": preset["name"],
+        "a": preset["amp"],
+        "s": preset.get("song_name", ""),
+        "r": preset.get("artist", ""),
+        "q": f"{search_text(preset['name'])}\n{search_text(preset['amp'])}",
+        "t": int(time.time()),
+    }
+
+def from_item(item: dict) -> dict:
+    """The API's view of a preset; settings are in KNOBS order"""
+    return {
+        "id": item["presetId"],
+        "name": item["n"],
+        "amp": item["a"],
+        "song_name": item.get("s", ""),
+        "artist": item.get("r", ""),
+        "created_at": int(item["t"]),
+        "settings": unpack_knobs(item["k"]),
+    }
+
+class PresetStore:
+    def __init__(self, table):
+        self.table = table
+
+    def write(self, user_id: str, presets: List[dict], delete_ids: List[str]) -> List[str]:
+        """Add presets and delete others in batched writes; returns the new ids"""
+        items = [to_item(user_id, preset) for preset in presets]
+        # batch_writer sends BatchWriteItem requests of up to 25 and resends
+        # unprocessed items; duplicate deletes would fail the whole batch
+        with self.table.batch_writer(overwrite_by_pkeys=["userId", "presetId"]) as batch:
+            for item in items:
+                batch.put_item(Item=item)
+            for preset_id in delete_ids:
+                batch.delete_item(Key={"userId": user_id, "presetId": preset_id})
+        return [item["presetId"] for item in items]
+
+    def page(self, user_id: str, limit: int, cursor: Optional[str] = None,
+             search: str = "") -> Tuple[List[dict], Optional[str]]:
+        """Up to limit presets, newest first, starting after cursor (a preset
+        id), whose name or amp contain search; returns them and the cursor for
+        the next page, or None when there are no more"""
+        needle = search_text(search)
+        query = {
+            "KeyConditionExpression": "userId = :u",
+            "ExpressionAttributeValues": {":u": user_id},
+            "ScanIndexForward": False,
+            # Strongly consistent, so a listing never pairs a new revision
+            # (see application.py) with items from before the write
+            "ConsistentRead": True,
+        }
+        if needle:
+            query["FilterExpression"] = "contains(q, :q)"
+            query["ExpressionAttributeValues"][":q"] = needle
+
+        items = []
+        while True:
+            if cursor:
+                query["ExclusiveStartKey"] = {"userId": user_id, "presetId": cursor}
+            query["Limit"] = max(limit, SEARCH_READ_SIZE) if needle else limit - len(items)
+            response = self.table.query(**query)
+            items.extend(response["Items"])
+            if len(items) > limit:
+                # Read past the page while searching: continue from the last item kept
+                items = items[:limit]
+                return [from_item(item) for item in items], items[-1]["presetId"]
+            last_key = response.get("LastEvaluatedKey")
+            cursor = last_key["presetId"] if last_key else None
+            if cursor is None or len(items) == limit:
+                return [from_item(item) for item in items], cursor
@@ -1,5 +1,6 @@
 (function() {
   const makeAmpBtn = document.querySelector(".make-amp-btn");
+  const savePresetBtn = document.querySelector(".save-preset-btn");
   const knobs = document.querySelectorAll(".knob");
 
   console.log("🚀 make-amp.js loaded (protected version)!");
@@ -62,6 +63,48 @@
     });
   }
 
+  // Current knob positions, including any turned by hand after generating
+  function readKnobs() {
+    const settings = {};
+    knobs.forEach((knob) => {
+      const label = knob.querySelector("label").textContent.toLowerCase();
+      settings[label] = Number(knob.querySelector(".knob-value").textContent);
+    });
+    return settings;
+  }
+
+  // Song the knobs were last generated for, saved with the preset
+  let generatedSong = null;
+
+  async function savePreset() {
+    if (!generatedSong) return;
+    const preset = {
+      name: generatedSong.name,
+      song_name: generatedSong.name,
+      artist: generatedSong.artist || "",
+      settings: readKnobs()
+    };
+    savePresetBtn.disabled = true;
+    try {
+      const response = await fetch(`/api/presets`, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          "Authorization": `Bearer ${token}`
+        },
+        body: JSON.stringify({ presets: [preset] }),
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      savePresetBtn.textContent = "Saved";
+    } catch (error) {
+      console.error("❌ Error saving preset:", error);
+      alert(`Failed to save preset: ${error.message}`);
+      savePresetBtn.disabled = false;
+    }
+  }
+
   // Function to apply all amp settings
   function applyAmpSettings(settings) {
     console.log("🎛️ Applying settings:", settings);
@@ -73,6 +116,90 @@
     if (settings.master !== undefined) updateKnob("Master", settings.master);
   }
 
+  // Read server-sent events from a fetch response, calling onEvent(event, data)
+  async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      let boundary;
+      while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+
+        let event = "message";
+        let data = "";
+        rawEvent.split("\n").forEach((line) => {
+          if (line.startsWith("event:")) event = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).trim();
+        });
+        if (data) onEvent(event, JSON.parse(data));
+      }
+    }
+  }
+
+  // An Error carrying the HTTP status it came with
+  function httpError(status, detail) {
+    const error = new Error(detail || `HTTP error! status: ${status}`);
+    error.status = status;
+    return error;
+  }
+
+  function isFinished(job) {
+    return job.status === "done" || job.status === "failed" || job.status === "not_found";
+  }
+
+  // Wait for a generation job over a WebSocket, which pushes its status when it finishes
+  function waitOnSocket(jobId) {
+    return new Promise((resolve, reject) => {
+      const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+      const socket = new WebSocket(`${scheme}://${window.location.host}/api/jobs/${jobId}/ws`);
+      let result = null;
+      // The token goes in the first message, never the URL, which is logged
+      socket.onopen = () => socket.send(JSON.stringify({ token }));
+      socket.onmessage = (message) => {
+        const job = JSON.parse(message.data);
+        console.log("📡 Job update:", job.status);
+        if (isFinished(job)) {
+          result = job;
+          socket.close();
+        }
+      };
+      socket.onclose = () => {
+        if (result) resolve(result);
+        else reject(new Error("WebSocket closed before the job finished"));
+      };
+    });
+  }
+
+  // Fallback when WebSockets are unavailable: long-poll the job
+  async function pollJob(jobId) {
+    while (true) {
+      const response = await fetch(`/api/jobs/${jobId}?wait=20`, {
+        headers: { "Authorization": `Bearer ${token}` }
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
+      const job = await response.json();
+      if (isFinished(job)) return job;
+    }
+  }
+
+  async function waitForJob(jobId) {
+    try {
+      return await waitOnSocket(jobId);
+    } catch (error) {
+      console.warn("⚠️ Falling back to polling:", error.message);
+      return await pollJob(jobId);
+    }
+  }
+
   // Function to show loading state
   function setLoadingState(isLoading) {
     console.log("⏳ Loading state:", isLoading);
@@ -89,6 +216,82 @@
     }
   }
 
+  // Stream the settings, turning each knob as the server sends its value
+  async function streamSettings(requestBody) {
+    console.log("📤 Sending authenticated request to:", `/api/get_amp_settings/stream`);
+    console.log("📦 Request body:", requestBody);
+
+    // Make request to backend WITH AUTH TOKEN
+    const response = await fetch(`/api/get_amp_settings/stream`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "Authorization": `Bearer ${token}` // Add auth token
+      },
+      body: JSON.stringify(requestBody),
+    });
+
+    console.log("📥 Response status:", response.status);
+
+    if (!response.ok) {
+      const errorText = await response.text();
+      console.error("❌ Error response:", errorText);
+      throw httpError(response.status);
+    }
+
+    // Knobs turn one by one as the server streams each value in
+    let finalSettings = null;
+    await readEventStream(response, (event, data) => {
+      if (event === "knob") {
+        updateKnob(data.knob, data.value);
+      } else if (event === "done") {
+        if (data.fallback) {
+          // Generation ran out of time; these are the closest settings to hand
+          console.warn(`⚠️ ${data.detail}; using ${data.fallback} settings`);
+        }
+        finalSettings = data.settings;
+      } else if (event === "error") {
+        throw httpError(data.status, data.detail);
+      }
+    });
+    if (!finalSettings) {
+      throw new Error("Stream ended before the settings were done");
+    }
+    return finalSettings;
+  }
+
+  // Get the settings from a generation job. Submitting a song again returns
+  // the job already running for it, and a job for a song still being
+  // streamed waits on that generation, so this is how a failed stream retries
+  async function settingsFromJob(requestBody) {
+    console.log("📤 Submitting generation job to:", `/api/jobs`);
+    const response = await fetch(`/api/jobs`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "Authorization": `Bearer ${token}`
+      },
+      body: JSON.stringify(requestBody),
+    });
+    if (!response.ok) {
+      throw httpError(response.status);
+    }
+
+    let job = await response.json();
+    console.log("🧾 Job", job.job_id, job.status);
+    if (!isFinished(job)) {
+      job = await waitForJob(job.job_id);
+    }
+    if (!job.settings) {
+      throw new Error((job.error && job.error.detail) || `job ${job.status}`);
+    }
+    if (job.error && job.error.fallback) {
+      // Generation ran out of time; these are the closest settings to hand
+      console.warn(`⚠️ ${job.error.detail}; using ${job.error.fallback} settings`);
+    }
+    return job.settings;
+  }
+
   // Main function to get amp settings from backend
   async function makeAmp() {
     console.log("🎸 Make Amp button clicked!");
@@ -113,49 +316,39 @@
         spotify_id: selectedSong.spotifyId,
         desired_tone: "authentic to the original recording"
       };
-      
-      console.log("📤 Sending authenticated request to:", `/api/get_amp_settings`);
-      console.log("📦 Request body:", requestBody);
-
-      // Make request to backend WITH AUTH TOKEN
-      const response = await fetch(`/api/get_amp_settings`, {
-        method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-          "Authorization": `Bearer ${token}` // Add auth token
-        },
-        body: JSON.stringify(requestBody),
-      });
-
-      console.log("📥 Response status:", response.status);
 
-      if (response.status === 401) {
-        // Token expired or invalid
-        alert("Session expired. Please login again.");
-        localStorage.removeItem('ampai_token');
-        localStorage.removeItem('ampai_user');
-        window.location.href = '/';
-        return;
+      let finalSettings;
+      try {
+        finalSettings = await streamSettings(requestBody);
+      } catch (error) {
+        // A dropped connection or a server-side failure is retried as a job;
+        // client errors (bad session, rate limit) would only fail again
+        if (error.status && error.status < 500) throw error;
+        console.warn("⚠️ Stream failed, retrying as a job:", error.message);
+        finalSettings = await settingsFromJob(requestBody);
       }
 
-      if (!response.ok) {
-        const errorText = await response.text();
-        console.error("❌ Error response:", errorText);
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
+      console.log("✅ Received settings:", finalSettings);
 
-      const data = await response.json();
-      console.log("✅ Received data:", data);
-      
-      // Apply the settings to the knobs
-      if (data.settings) {
-        applyAmpSettings(data.settings);
+      if (finalSettings) {
+        applyAmpSettings(finalSettings);
+        generatedSong = selectedSong;
+        savePresetBtn.textContent = "Save Preset";
+        savePresetBtn.disabled = false;
       } else {
         console.error("❌ No settings in response");
         throw new Error("No settings received from server");
       }
 
     } catch (error) {
+      if (error.status === 401) {
+        // Token expired or invalid
+        alert("Session expired. Please login again.");
+        localStorage.removeItem('ampai_token');
+        localStorage.removeItem('ampai_user');
+        window.location.href = '/';
+        return;
+      }
       console.error("❌ Error:", error);
       alert(`Failed to generate amp settings: ${error.message}`);
     } finally {
@@ -166,6 +359,7 @@
   // Add click event listener to Make Amp button
   console.log("🔗 Adding click listener to button");
   makeAmpBtn.addEventListener("click", makeAmp);
+  savePresetBtn.addEventListener("click", savePreset);
 
   console.log("✅ make-amp.js fully initialized with authentication!");
 })();
\ No newline at end of file
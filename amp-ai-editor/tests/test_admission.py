@@ -0,0 +1,158 @@
+# tests/test_admission.py
+# Per-user rate limits and the admission gate's queue: ordering, eviction,
+# deadlines and callers that go away.
+#
+#   python -m unittest discover tests   (from amp-ai-editor/)
+import asyncio
+import math
+import unittest
+
+from admission import AdmissionGate, Rejected, TokenBucket, UserRateLimiter, INTERACTIVE, BATCH
+
+class TokenBucketTest(unittest.TestCase):
+    def test_takes_until_empty_then_reports_the_wait(self):
+        bucket = TokenBucket(rate=1.0, burst=2)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertAlmostEqual(bucket.take(), 1.0, places=2)
+
+    def test_refills_from_the_time_of_the_last_take(self):
+        bucket = TokenBucket(rate=1.0, burst=2)
+        bucket.take(2)
+        bucket.updated -= 1.5
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+
+class UserRateLimiterTest(unittest.TestCase):
+    def test_charges_the_full_cost(self):
+        limiter = UserRateLimiter(rate_per_minute=30, burst=10)
+        self.assertEqual(limiter.take("u", 8), 0)
+        self.assertGreater(limiter.take("u", 8), 0)
+        self.assertEqual(limiter.limited, 1)
+
+    def test_cost_over_the_burst_is_never_allowed(self):
+        limiter = UserRateLimiter(rate_per_minute=30, burst=10)
+        self.assertEqual(limiter.take("u", 50), math.inf)
+        # and takes nothing, so smaller requests still go ahead
+        self.assertEqual(limiter.take("u", 10), 0)
+
+    def test_users_have_their_own_buckets(self):
+        limiter = UserRateLimiter(rate_per_minute=30, burst=1)
+        self.assertEqual(limiter.take("a"), 0)
+        self.assertGreater(limiter.take("a"), 0)
+        self.assertEqual(limiter.take("b"), 0)
+
+    def test_rate_of_zero_disables_the_limit(self):
+        limiter = UserRateLimiter(rate_per_minute=0, burst=1)
+        for _ in range(100):
+            self.assertEqual(limiter.take("u", 50), 0)
+
+    def test_forgets_the_least_recently_seen_user(self):
+        limiter = UserRateLimiter(rate_per_minute=30, burst=1, max_users=2)
+        limiter.take("a")
+        limiter.take("b")
+        limiter.take("a")
+        limiter.take("c")
+        self.assertEqual(list(limiter.buckets), ["a", "c"])
+
+class AdmissionGateTest(unittest.IsolatedAsyncioTestCase):
+    async def test_admits_up_to_max_in_flight_at_once(self):
+        gate = AdmissionGate(max_in_flight=2, max_queued=4)
+        await gate.acquire(INTERACTIVE, 1)
+        await gate.acquire(BATCH, 1)
+        self.assertEqual(gate.in_flight, 2)
+        self.assertFalse(gate.has_spare_capacity())
+
+    async def test_release_hands_the_slot_to_interactive_waiters_first(self):
+        gate = AdmissionGate(max_in_flight=1, max_queued=4)
+        await gate.acquire(INTERACTIVE, 1)
+        order = []
+
+        async def wait(priority):
+            await gate.acquire(priority, 1)
+            order.append(priority)
+
+        batch = asyncio.ensure_future(wait(BATCH))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(wait(INTERACTIVE))
+        await asyncio.sleep(0)
+        self.assertEqual(gate.queued, 2)
+
+        gate.release()
+        await interactive
+        self.assertEqual(order, [INTERACTIVE])
+        gate.release()
+        await batch
+        self.assertEqual(order, [INTERACTIVE, BATCH])
+        self.assertEqual((gate.in_flight, gate.queued), (1, 0))
+
+    async def test_full_queue_turns_callers_away(self):
+        gate = AdmissionGate(max_in_flight=1, max_queued=1)
+        await gate.acquire(INTERACTIVE, 1)
+        waiter = asyncio.ensure_future(gate.acquire(INTERACTIVE, 1))
+        await asyncio.sleep(0)
+        self.assertTrue(gate.would_reject(INTERACTIVE))
+        with self.assertRaises(Rejected) as caught:
+            await gate.acquire(BATCH, 1)
+        self.assertEqual(caught.exception.reason, "queue_full")
+        self.assertGreaterEqual(caught.exception.retry_after, 1)
+        self.assertEqual(gate.stats["shed_full"], 1)
+        gate.release()
+        await waiter
+
+    async def test_interactive_caller_evicts_the_newest_batch_waiter(self):
+        gate = AdmissionGate(max_in_flight=1, max_queued=2)
+        await gate.acquire(INTERACTIVE, 1)
+        older = asyncio.ensure_future(gate.acquire(BATCH, 1))
+        await asyncio.sleep(0)
+        newer = asyncio.ensure_future(gate.acquire(BATCH, 1))
+        await asyncio.sleep(0)
+        self.assertTrue(gate.would_reject(BATCH))
+        self.assertFalse(gate.would_reject(INTERACTIVE))
+
+        interactive = asyncio.ensure_future(gate.acquire(INTERACTIVE, 1))
+        with self.assertRaises(Rejected) as caught:
+            await newer
+        self.assertEqual(caught.exception.reason, "evicted")
+        self.assertEqual(gate.queued, 2)
+
+        gate.release()
+        await interactive
+        self.assertFalse(older.done())
+        gate.release()
+        await older
+        self.assertEqual(gate.stats["evicted"], 1)
+
+    async def test_deadline_gives_up_the_place_in_the_queue(self):
+        gate = AdmissionGate(max_in_flight=1, max_queued=4)
+        await gate.acquire(INTERACTIVE, 1)
+        with self.assertRaises(Rejected) as caught:
+            await gate.acquire(INTERACTIVE, 0.01)
+        self.assertEqual(caught.exception.reason, "deadline")
+        self.assertEqual((gate.in_flight, gate.queued), (1, 0))
+        gate.release()
+        self.assertEqual(gate.in_flight, 0)
+
+    async def test_cancelled_waiter_gives_up_its_place(self):
+        gate = AdmissionGate(max_in_flight=1, max_queued=4)
+        await gate.acquire(INTERACTIVE, 1)
+        waiter = asyncio.ensure_future(gate.acquire(INTERACTIVE, 1))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(gate.queued, 0)
+        gate.release()
+        self.assertEqual(gate.in_flight, 0)
+
+    async def test_rate_limit_delays_admission(self):
+        gate = AdmissionGate(max_in_flight=10, max_queued=4, rate=50, burst=1)
+        await gate.acquire(INTERACTIVE, 1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await gate.acquire(INTERACTIVE, 1)
+        self.assertGreaterEqual(loop.time() - started, 0.01)
+        self.assertEqual((gate.in_flight, gate.queued), (2, 0))
+
+if __name__ == "__main__":
+    unittest.main()
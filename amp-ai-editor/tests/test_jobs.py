@@ -0,0 +1,189 @@
+# tests/test_jobs.py
+# Job reuse by request key, claiming, results and stale jobs, for each store.
+# The Redis store runs against fakeredis when it is installed.
+#
+#   python -m unittest discover tests   (from amp-ai-editor/)
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+import jobs
+from jobs import DONE, FAILED, QUEUED, RUNNING, MemoryJobStore, SqliteJobStore, new_job, reusable
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+SETTINGS = {"gain": 70, "volume": 60, "bass": 55, "treble": 65, "presence": 50, "master": 40}
+
+def aged(job: dict, status: str, seconds: float) -> dict:
+    return {**job, "status": status, "updated_at": time.time() - seconds}
+
+class ReusableTest(unittest.TestCase):
+    def test_nothing_or_failed_is_not_reused(self):
+        self.assertFalse(reusable(None, 60))
+        self.assertFalse(reusable(aged(new_job("k", {}), FAILED, 0), 60))
+
+    def test_queued_and_running_are_reused(self):
+        self.assertTrue(reusable(new_job("k", {}), 60))
+        self.assertTrue(reusable(aged(new_job("k", {}), RUNNING, 3600), 60))
+
+    def test_done_is_reused_until_the_ttl(self):
+        self.assertTrue(reusable(aged(new_job("k", {}), DONE, 30), 60))
+        self.assertFalse(reusable(aged(new_job("k", {}), DONE, 90), 60))
+
+    def test_running_past_stale_seconds_is_not_reused(self):
+        self.assertTrue(reusable(aged(new_job("k", {}), RUNNING, 30), 60, stale_seconds=120))
+        self.assertFalse(reusable(aged(new_job("k", {}), RUNNING, 150), 60, stale_seconds=120))
+
+class JobStoreTests:
+    """Behaviour every store shares; mixed into a TestCase per store"""
+
+    async def test_submitting_a_key_again_returns_the_same_job(self):
+        first, created = await self.store.submit("k", {"song_name": "a"})
+        self.assertTrue(created)
+        self.assertEqual(first["status"], QUEUED)
+        again, created = await self.store.submit("k", {"song_name": "a"})
+        self.assertFalse(created)
+        self.assertEqual(again["id"], first["id"])
+        self.assertEqual((await self.store.find("k"))["id"], first["id"])
+        self.assertIsNone(await self.store.find("other"))
+
+    async def test_next_claims_a_job_and_finish_records_the_result(self):
+        job, _ = await self.store.submit("k", {"song_name": "a"})
+        claimed = await asyncio.wait_for(self.store.next(), 5)
+        self.assertEqual((claimed["id"], claimed["status"]), (job["id"], RUNNING))
+        self.assertEqual(claimed["song"], {"song_name": "a"})
+
+        waiting = asyncio.ensure_future(self.store.wait(job["id"], 5))
+        await asyncio.sleep(0.05)
+        await self.store.finish(job["id"], settings=SETTINGS)
+        finished = await waiting
+        self.assertEqual((finished["status"], finished["settings"]), (DONE, SETTINGS))
+
+        again, created = await self.store.submit("k", {"song_name": "a"})
+        self.assertFalse(created)
+        self.assertEqual(again["id"], job["id"])
+
+    async def test_failed_job_is_replaced_by_a_new_one(self):
+        job, _ = await self.store.submit("k", {})
+        await asyncio.wait_for(self.store.next(), 5)
+        await self.store.finish(job["id"], error={"status": 500, "detail": "boom"})
+        failed = await self.store.get(job["id"])
+        self.assertEqual((failed["status"], failed["error"]["detail"]), (FAILED, "boom"))
+
+        replacement, created = await self.store.submit("k", {})
+        self.assertTrue(created)
+        self.assertNotEqual(replacement["id"], job["id"])
+
+    async def test_wait_returns_the_job_as_it_is_at_the_timeout(self):
+        job, _ = await self.store.submit("k", {})
+        self.assertEqual((await self.store.wait(job["id"], 0.05))["status"], QUEUED)
+        self.assertIsNone(await self.store.get("missing"))
+
+class MemoryJobStoreTest(JobStoreTests, unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = MemoryJobStore(ttl_seconds=60)
+        await self.store.start()
+
+    async def test_prune_drops_expired_finished_jobs(self):
+        job, _ = await self.store.submit("k", {})
+        await self.store.finish(job["id"], settings=SETTINGS)
+        self.store.jobs[job["id"]]["updated_at"] -= 120
+        self.store.prune()
+        self.assertIsNone(await self.store.get(job["id"]))
+        self.assertNotIn("k", self.store.keys)
+
+class SqliteJobStoreTest(JobStoreTests, unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "jobs.db")
+        self.store = SqliteJobStore(self.path, ttl_seconds=60, stale_seconds=120, poll_seconds=0.01)
+        await self.store.start()
+
+    async def asyncTearDown(self):
+        await self.store.close()
+        self.directory.cleanup()
+
+    async def other_process(self) -> SqliteJobStore:
+        store = SqliteJobStore(self.path, ttl_seconds=60, poll_seconds=0.01)
+        await store.start()
+        self.addAsyncCleanup(store.close)
+        return store
+
+    async def test_processes_share_jobs(self):
+        other = await self.other_process()
+        job, _ = await self.store.submit("k", {})
+        again, created = await other.submit("k", {})
+        self.assertFalse(created)
+        self.assertEqual(again["id"], job["id"])
+        self.assertEqual((await asyncio.wait_for(other.next(), 5))["id"], job["id"])
+
+    async def test_stale_running_job_is_claimed_again(self):
+        job, _ = await self.store.submit("k", {})
+        await asyncio.wait_for(self.store.next(), 5)
+        self.assertIsNone(await asyncio.to_thread(self.store.run, self.store.claim))
+        self.store.connection.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - 150, job["id"]))
+        reclaimed = await asyncio.to_thread(self.store.run, self.store.claim)
+        self.assertEqual((reclaimed["id"], reclaimed["status"]), (job["id"], RUNNING))
+
+    async def test_one_worker_polls_at_a_time(self):
+        claims = 0
+        claim = self.store.claim
+
+        def counting_claim():
+            nonlocal claims
+            claims += 1
+            return claim()
+
+        self.store.claim = counting_claim
+        self.store.max_poll_seconds = 0.04
+        workers = [asyncio.ensure_future(self.store.next()) for _ in range(8)]
+        await asyncio.sleep(0.3)
+        # Backing off 0.01, 0.02, 0.04, 0.04...: about eight polls, not eight per poll
+        self.assertLess(claims, 15)
+
+        for i in range(3):
+            await self.store.submit(f"k{i}", {})
+        await asyncio.sleep(0.1)
+        self.assertEqual(sum(worker.done() for worker in workers), 3)
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def test_prune_drops_expired_finished_jobs(self):
+        job, _ = await self.store.submit("k", {})
+        await self.store.finish(job["id"], settings=SETTINGS)
+        self.store.connection.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (time.time() - 120, job["id"]))
+        await asyncio.to_thread(self.store.run, self.store.prune)
+        self.assertIsNone(await self.store.get(job["id"]))
+
+@unittest.skipIf(fakeredis is None or jobs.aioredis is None, "needs the redis and fakeredis packages")
+class RedisJobStoreTest(JobStoreTests, unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.store = jobs.RedisJobStore("redis://localhost", ttl_seconds=60, stale_seconds=120)
+        self.store.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await self.store.start()
+
+    async def asyncTearDown(self):
+        await self.store.close()
+
+    async def test_stale_running_job_is_failed_and_replaced(self):
+        job, _ = await self.store.submit("k", {})
+        claimed = await asyncio.wait_for(self.store.next(), 5)
+        await self.store.save(aged(claimed, RUNNING, 150))
+        self.assertIsNone(await self.store.find("k"))
+
+        waiting = asyncio.ensure_future(self.store.wait(job["id"], 5))
+        await asyncio.sleep(0.05)
+        replacement, created = await self.store.submit("k", {})
+        self.assertTrue(created)
+        self.assertNotEqual(replacement["id"], job["id"])
+        lost = await waiting
+        self.assertEqual((lost["status"], lost["error"]["status"]), (FAILED, 500))
+
+if __name__ == "__main__":
+    unittest.main()
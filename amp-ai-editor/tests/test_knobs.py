@@ -0,0 +1,50 @@
+# tests/test_knobs.py
+# Knob cleaning, and picking knob values out of a streamed reply.
+#
+#   python -m unittest discover tests   (from amp-ai-editor/)
+import json
+import unittest
+
+from knobs import KnobStreamParser, clamp_knob, clean_knobs
+from presets import KNOBS
+
+REPLY = json.dumps({"gain": 75, "volume": 60, "bass": 55.4, "treble": 65, "presence": 50, "master": 40}, indent=1)
+
+class CleanKnobsTest(unittest.TestCase):
+    def test_clamps_and_rounds(self):
+        self.assertEqual([clamp_knob(v) for v in (-5, 0, 49.5, 100, 250)], [0, 0, 50, 100, 100])
+
+    def test_garbled_values_are_50(self):
+        for value in (None, "80", True, float("nan"), [1]):
+            self.assertEqual(clamp_knob(value), 50)
+
+    def test_every_knob_is_filled_in(self):
+        self.assertEqual(clean_knobs({"gain": 80, "bogus": 1}), {knob: 80 if knob == "gain" else 50 for knob in KNOBS})
+
+class KnobStreamParserTest(unittest.TestCase):
+    def test_reports_each_knob_once_as_it_completes(self):
+        parser = KnobStreamParser()
+        seen = []
+        for ch in REPLY:
+            seen.extend(parser.feed(ch))
+        self.assertEqual(seen, [("gain", 75), ("volume", 60), ("bass", 55), ("treble", 65), ("presence", 50), ("master", 40)])
+        self.assertEqual(json.loads(parser.text), json.loads(REPLY))
+
+    def test_waits_for_the_character_after_a_number(self):
+        parser = KnobStreamParser()
+        self.assertEqual(parser.feed('{"gain": 7'), [])
+        self.assertEqual(parser.feed('5'), [])
+        self.assertEqual(parser.feed(', "vol'), [("gain", 75)])
+        self.assertEqual(parser.feed('ume": 101}'), [("volume", 100)])
+
+    def test_ignores_unknown_keys_and_non_numbers(self):
+        parser = KnobStreamParser()
+        self.assertEqual(parser.feed('{"reverb": 30, "gain": "high", "bass": -3 }'), [("bass", 0)])
+
+    def test_keeps_the_first_value_of_a_repeated_knob(self):
+        parser = KnobStreamParser()
+        self.assertEqual(parser.feed('{"gain": 10, "gain": 90}'), [("gain", 10)])
+        self.assertEqual(parser.settings, {"gain": 10})
+
+if __name__ == "__main__":
+    unittest.main()
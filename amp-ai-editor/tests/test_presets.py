@@ -0,0 +1,76 @@
+# tests/test_presets.py
+# PresetStore paging and search over a MemoryTable, which applies Limit
+# before FilterExpression the way DynamoDB does.
+#
+#   python -m unittest discover tests   (from amp-ai-editor/)
+import unittest
+from unittest import mock
+
+import presets
+from memory_table import MemoryTable
+from presets import PresetStore, to_item
+
+SETTINGS = {"gain": 70, "volume": 60, "bass": 55, "treble": 65, "presence": 50, "master": 40}
+
+class PresetStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.table = MemoryTable("userId", range_key="presetId")
+        self.store = PresetStore(self.table)
+        # Ids that sort by creation, oldest first: preset 0 ... preset 24,
+        # every third one on a Vox AC30
+        self.ids = []
+        for i in range(25):
+            item = to_item("u", {
+                "name": f"Preset {i}",
+                "amp": "Vox AC30" if i % 3 == 0 else "Marshall Plexi",
+                "settings": SETTINGS,
+            })
+            item["presetId"] = f"{i:011x}00000000"
+            self.table.put_item(Item=item)
+            self.ids.append(item["presetId"])
+        self.table.put_item(Item=to_item("someone else", {"name": "Preset x", "amp": "Vox AC30", "settings": SETTINGS}))
+
+    def all_pages(self, limit: int, search: str = "") -> list:
+        pages, cursor = [], None
+        while True:
+            page, cursor = self.store.page("u", limit, cursor, search)
+            pages.append([preset["name"] for preset in page])
+            if cursor is None:
+                return pages
+
+    def test_pages_run_newest_first_without_gaps(self):
+        pages = self.all_pages(10)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(sum(pages, []), [f"Preset {i}" for i in range(24, -1, -1)])
+
+    def test_full_last_page_ends_the_listing(self):
+        pages = self.all_pages(5)
+        self.assertEqual([len(page) for page in pages], [5] * 5)
+        self.assertEqual(sum(pages, []), [f"Preset {i}" for i in range(24, -1, -1)])
+
+    def test_search_pages_through_filtered_reads(self):
+        expected = [f"Preset {i}" for i in range(24, -1, -1) if i % 3 == 0]
+        # Small reads, so one page of matches takes several round trips
+        with mock.patch.object(presets, "SEARCH_READ_SIZE", 4):
+            for limit in (1, 2, 3, 9, 20):
+                pages = self.all_pages(limit, "vox")
+                self.assertEqual(sum(pages, []), expected, f"limit {limit}")
+                self.assertTrue(all(len(page) <= limit for page in pages))
+
+    def test_search_is_case_and_accent_insensitive(self):
+        self.table.put_item(Item={**to_item("u", {"name": "Crème Brûlée", "amp": "Fender", "settings": SETTINGS}), "presetId": "fffffffffff00000000"})
+        page, _ = self.store.page("u", 5, search="CREME")
+        self.assertEqual([preset["name"] for preset in page], ["Crème Brûlée"])
+
+    def test_settings_round_trip_in_knob_order(self):
+        page, _ = self.store.page("u", 1)
+        self.assertEqual(page[0]["settings"], [SETTINGS[knob] for knob in presets.KNOBS])
+        self.assertEqual(page[0]["id"], self.ids[-1])
+
+    def test_write_adds_and_deletes(self):
+        new_ids = self.store.write("u", [{"name": "New", "amp": "Fender", "settings": SETTINGS}], self.ids[:20])
+        self.assertEqual(len(new_ids), 1)
+        self.assertEqual(sum(self.all_pages(100), []), ["New"] + [f"Preset {i}" for i in range(24, 19, -1)])
+
+if __name__ == "__main__":
+    unittest.main()